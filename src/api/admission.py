@@ -0,0 +1,302 @@
+"""Admission control and load shedding for the recommendations path.
+
+Two levels:
+- RequestGate (event loop): caps requests in flight, with a bounded wait queue and a maximum
+  queueing delay, so excess load is shed before it occupies threadpool threads.
+- guard(backend) (worker threads): per-datastore concurrency limit (Bulkhead) and circuit breaker
+  that opens on error rate or slow-call rate.
+
+Both raise Overloaded; the API answers with a degraded response or a fast 503 instead of
+letting requests queue behind a slow datastore.
+"""
+import asyncio
+import threading
+import time
+from collections import Counter, deque
+from contextlib import asynccontextmanager, contextmanager
+
+import numpy as np
+
+from src.utils.config import settings
+from src.utils.logger import log_anomaly
+
+
+class Overloaded(Exception):
+    """The request was not admitted (queue full or queued too long)."""
+
+
+class BackendUnavailable(Overloaded):
+    """A datastore is shedding load: its circuit is open or its concurrency limit is exhausted."""
+
+
+class RequestGate:
+    """Bounded in-flight requests with a bounded, time-limited wait queue (one per event loop)."""
+
+    def __init__(self, max_inflight: int, max_waiting: int, max_queue_delay_seconds: float, latency_window: int = 2000):
+        self.max_inflight = max_inflight
+        self.max_waiting = max_waiting
+        self.max_queue_delay_seconds = max_queue_delay_seconds
+        self._sem: asyncio.Semaphore | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._inflight = 0
+        self._waiting = 0
+        self._counts = Counter()
+        self._latencies: deque[float] = deque(maxlen=latency_window)
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        # asyncio primitives belong to one loop; a new loop (server restart, test client) gets a fresh one.
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._sem, self._loop = asyncio.Semaphore(self.max_inflight), loop
+            self._inflight = self._waiting = 0
+        return self._sem
+
+    @asynccontextmanager
+    async def admit(self):
+        sem = self._semaphore()
+        if sem.locked():
+            if self._waiting >= self.max_waiting:
+                self._counts["rejected_queue_full"] += 1
+                raise Overloaded(f"{self._waiting} requests already waiting")
+            self._waiting += 1
+            try:
+                await asyncio.wait_for(sem.acquire(), self.max_queue_delay_seconds)
+            except asyncio.TimeoutError:
+                self._counts["rejected_queue_delay"] += 1
+                raise Overloaded(f"queued longer than {self.max_queue_delay_seconds * 1000:.0f} ms")
+            finally:
+                self._waiting -= 1
+        else:
+            await sem.acquire()
+        self._inflight += 1
+        try:
+            yield
+        finally:
+            self._inflight -= 1
+            sem.release()
+
+    def reset(self) -> None:
+        """Clear counters and latencies; the semaphore is recreated on the next request."""
+        self._loop = None
+        self._counts.clear()
+        self._latencies.clear()
+
+    def observe(self, outcome: str, seconds: float) -> None:
+        """Record how a request ended: ok, degraded, rejected or error."""
+        self._counts[outcome] += 1
+        if outcome in ("ok", "degraded"):
+            self._latencies.append(seconds * 1000)
+
+    def stats(self) -> dict:
+        latencies = np.fromiter(self._latencies, dtype=np.float64)
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]).round(2).tolist() if latencies.size else (0.0, 0.0, 0.0)
+        return {
+            "inflight": self._inflight,
+            "waiting": self._waiting,
+            "max_inflight": self.max_inflight,
+            **{k: self._counts[k] for k in ("ok", "degraded", "rejected", "error", "rejected_queue_full", "rejected_queue_delay")},
+            "latency_ms": {"p50": p50, "p95": p95, "p99": p99, "samples": int(latencies.size)},
+        }
+
+
+class Bulkhead:
+    """Concurrency limit for one datastore; callers wait at most max_wait_seconds, and only
+    max_waiting of them may wait at once. max_concurrent <= 0 disables the limit."""
+
+    def __init__(self, name: str, max_concurrent: int, max_waiting: int, max_wait_seconds: float):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_waiting = max_waiting
+        self.max_wait_seconds = max_wait_seconds
+        self._sem = threading.BoundedSemaphore(max_concurrent) if max_concurrent > 0 else None
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._counts = Counter()
+
+    @contextmanager
+    def slot(self):
+        if self._sem is None:
+            yield
+            return
+        if not self._sem.acquire(blocking=False):
+            with self._lock:
+                if self._waiting >= self.max_waiting:
+                    self._counts["rejected"] += 1
+                    raise BackendUnavailable(f"{self.name}: {self._waiting} calls already waiting")
+                self._waiting += 1
+            try:
+                acquired = self._sem.acquire(timeout=self.max_wait_seconds)
+            finally:
+                with self._lock:
+                    self._waiting -= 1
+            if not acquired:
+                self._counts["timed_out"] += 1
+                raise BackendUnavailable(f"{self.name}: waited longer than {self.max_wait_seconds * 1000:.0f} ms")
+        try:
+            yield
+        finally:
+            self._sem.release()
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "waiting": self._waiting,
+            "rejected": self._counts["rejected"],
+            "timed_out": self._counts["timed_out"],
+        }
+
+
+class CircuitBreaker:
+    """
+    Closed -> open when, over the last `window` calls (at least `min_calls`), the error rate or
+    the share of calls slower than `slow_call_seconds` reaches its threshold. After
+    `open_seconds` one probe call is let through (half-open); it closes the circuit if it
+    succeeds in time and reopens it otherwise.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        window: int,
+        min_calls: int,
+        error_rate: float,
+        slow_call_seconds: float,
+        slow_call_rate: float,
+        open_seconds: float,
+    ):
+        self.name = name
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.state = self.CLOSED
+        self._outcomes: deque[tuple[bool, bool]] = deque(maxlen=window)  # (failed, slow)
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+        self._counts = Counter()
+
+    def before_call(self) -> None:
+        """Raise BackendUnavailable unless a call may go through now."""
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.open_seconds:
+                    self._counts["short_circuited"] += 1
+                    raise BackendUnavailable(f"{self.name}: circuit open")
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN:
+                if self._probe_in_flight:
+                    self._counts["short_circuited"] += 1
+                    raise BackendUnavailable(f"{self.name}: circuit half-open, probe in flight")
+                self._probe_in_flight = True
+
+    def cancel_call(self) -> None:
+        """The call allowed by before_call never reached the datastore."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record(self, failed: bool, seconds: float) -> None:
+        slow = seconds >= self.slow_call_seconds
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probe_in_flight = False
+                if failed or slow:
+                    self._open("probe failed" if failed else f"probe took {seconds * 1000:.0f} ms")
+                else:
+                    self.state = self.CLOSED
+                    self._outcomes.clear()
+                return
+            self._outcomes.append((failed, slow))
+            if len(self._outcomes) < self.min_calls:
+                return
+            errors = sum(f for f, _ in self._outcomes) / len(self._outcomes)
+            slow_share = sum(s for _, s in self._outcomes) / len(self._outcomes)
+            if errors >= self.error_rate:
+                self._open(f"error rate {errors:.0%}")
+            elif slow_share >= self.slow_call_rate:
+                self._open(f"slow-call rate {slow_share:.0%}")
+
+    def _open(self, reason: str) -> None:
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+        self._counts["opened"] += 1
+        log_anomaly("circuit_open", reason, backend=self.name)
+
+    def stats(self) -> dict:
+        return {"state": self.state, "opened": self._counts["opened"], "short_circuited": self._counts["short_circuited"]}
+
+
+def _backend(name: str, max_concurrent: int) -> tuple[Bulkhead, CircuitBreaker]:
+    return (
+        Bulkhead(name, max_concurrent, settings.backend_max_waiting, settings.backend_max_queue_delay_ms / 1000),
+        CircuitBreaker(
+            name,
+            window=settings.breaker_window,
+            min_calls=settings.breaker_min_calls,
+            error_rate=settings.breaker_error_rate,
+            slow_call_seconds=settings.breaker_slow_call_ms / 1000,
+            slow_call_rate=settings.breaker_slow_call_rate,
+            open_seconds=settings.breaker_open_seconds,
+        ),
+    )
+
+
+def _new_backends() -> dict[str, tuple[Bulkhead, CircuitBreaker]]:
+    return {
+        "redis": _backend("redis", 0),
+        "milvus": _backend("milvus", settings.backend_milvus_max_concurrency),
+        "neo4j": _backend("neo4j", settings.backend_neo4j_max_concurrency),
+        "sqlite": _backend("sqlite", 0),
+    }
+
+
+_backends = _new_backends()
+
+request_gate = RequestGate(
+    settings.admission_max_inflight,
+    settings.admission_max_waiting,
+    settings.admission_max_queue_delay_ms / 1000,
+)
+
+
+@contextmanager
+def guard(backend: str):
+    """Run the enclosed datastore call under `backend`'s circuit breaker and concurrency limit."""
+    bulkhead, breaker = _backends[backend]
+    breaker.before_call()
+    entered = False
+    try:
+        with bulkhead.slot():
+            entered = True
+            start = time.perf_counter()
+            try:
+                yield
+            except BackendUnavailable:
+                # Shed by another backend inside this block: says nothing about this one.
+                breaker.cancel_call()
+                raise
+            except Exception:
+                breaker.record(True, time.perf_counter() - start)
+                raise
+            breaker.record(False, time.perf_counter() - start)
+    except BackendUnavailable:
+        if not entered:
+            breaker.cancel_call()
+        raise
+
+
+def admission_stats() -> dict:
+    return {
+        "requests": request_gate.stats(),
+        "backends": {name: {**b.stats(), "circuit": c.stats()} for name, (b, c) in _backends.items()},
+    }
+
+
+def reset_admission() -> None:
+    """Fresh request counters, bulkheads and closed circuits (e.g. between load-test runs)."""
+    request_gate.reset()
+    _backends.update(_new_backends())
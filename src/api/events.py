@@ -0,0 +1,310 @@
+"""Real-time event ingestion: micro-batched embedding with write-behind flushes to the stores.
+
+POST /events only enqueues. An embed worker drains the queue in micro-batches, and the resulting
+message vectors and engagement deltas are coalesced in memory. A flusher writes them in batches
+(MongoDB, Milvus, SQLite, Neo4j) every `events_flush_interval_seconds`, or sooner once
+`events_flush_max_records` are pending, then invalidates the affected users' cached
+recommendations (Redis, the per-user version read by every API worker, and this process's
+intermediate caches). A user's profile vector is the mean of their message vectors in Milvus,
+so flushing the vectors is what updates it.
+"""
+import queue
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+
+from pymongo.errors import BulkWriteError
+
+from src.db import (
+    get_conversations_collection,
+    get_active_collection_name,
+    get_neo4j_client,
+    get_connection,
+    init_analytics_schema,
+    upsert_engagement_many,
+    invalidate_recommendations,
+)
+from src.api.recommendations import invalidate_local_caches, register_known_users
+from src.pipeline.embeddings import generate_embeddings
+from src.pipeline.compression import compress_records
+from src.pipeline.stores import store_milvus, derive_campaign_and_intent, record_lineage
+from src.utils.config import settings
+from src.utils.schemas import ConversationRecord, EnrichedRecord
+from src.utils.logger import logger, log_anomaly, log_pipeline_stage, measure_latency
+
+_DUPLICATE_KEY = 11000
+
+
+class IngestQueueFull(Exception):
+    """The ingest queue cannot take the whole batch; the caller should retry later."""
+
+
+class WriteBehindBuffer:
+    """
+    Pending writes, one section per store, so a failed store can be retried on its own. A section
+    that has failed events_flush_max_retries flushes in a row is dropped instead of restored, so a
+    store that keeps failing cannot grow it without bound.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sections = self._empty()
+        self._failures = Counter()  # consecutive failed flushes per section
+
+    @staticmethod
+    def _empty() -> dict:
+        return {
+            "mongodb": [],  # EnrichedRecord
+            "milvus": [],  # EnrichedRecord
+            "sqlite": Counter(),  # (user_id, campaign_id) -> engagement delta
+            "neo4j": Counter(),  # (user_id, campaign_id, intent) -> engagement delta
+        }
+
+    def add(self, records: list[EnrichedRecord]) -> int:
+        """Add embedded records; returns the number of vectors now pending."""
+        with self._lock:
+            self._sections["mongodb"].extend(records)
+            self._sections["milvus"].extend(records)
+            for r in records:
+                campaign_id, intent = derive_campaign_and_intent(r)
+                self._sections["sqlite"][(r.user_id, campaign_id)] += 1
+                self._sections["neo4j"][(r.user_id, campaign_id, intent)] += 1
+            return len(self._sections["milvus"])
+
+    def drain(self) -> dict:
+        with self._lock:
+            sections, self._sections = self._sections, self._empty()
+            return sections
+
+    def restore(self, name: str, data) -> bool:
+        """Put a section back after a failed write to retry it on the next flush; False if it was
+        dropped because the store has failed too many times in a row."""
+        with self._lock:
+            self._failures[name] += 1
+            if self._failures[name] > settings.events_flush_max_retries:
+                self._failures[name] = 0
+                return False
+            if isinstance(data, Counter):
+                self._sections[name].update(data)
+            else:
+                self._sections[name][:0] = data
+            return True
+
+    def written(self, name: str) -> None:
+        with self._lock:
+            self._failures[name] = 0
+
+    def retrying(self, name: str) -> bool:
+        """The section holds writes restored after a failure (possibly partly committed)."""
+        with self._lock:
+            return self._failures[name] > 0
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._sections["milvus"])
+
+
+# Writers take (data, flush_id, retry). A retry may follow a partly committed attempt, so each
+# write is idempotent (MongoDB, Milvus with retry) or a single transaction (SQLite, Neo4j).
+def _write_mongodb(records: list[EnrichedRecord], flush_id: str, retry: bool) -> None:
+    docs = [
+        {
+            "message_id": r.message_id,
+            "user_id": r.user_id,
+            "message": r.message,
+            "timestamp": r.timestamp.isoformat(),
+            "run_id": r.run_id,
+            "source_file": r.source_file,
+        }
+        for r in records
+    ]
+    try:
+        get_conversations_collection().insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        # A retried batch may already be partly stored; only duplicates are safe to ignore.
+        if any(err.get("code") != _DUPLICATE_KEY for err in e.details.get("writeErrors", [])):
+            raise
+
+
+def _write_milvus(records: list[EnrichedRecord], flush_id: str, retry: bool) -> None:
+    # Compressed at write time, for the collection being written to (it changes on a backfill swap).
+    collection = get_active_collection_name()
+    records = compress_records(records, flush_id, collection=collection)
+    store_milvus(records, flush_id, skip_existing=retry, collection=collection)
+
+
+def _write_sqlite(deltas: Counter, flush_id: str, retry: bool) -> None:
+    conn = get_connection()
+    init_analytics_schema(conn)
+    upsert_engagement_many(conn, [(user_id, campaign_id, n) for (user_id, campaign_id), n in deltas.items()])
+
+
+def _write_neo4j(deltas: Counter, flush_id: str, retry: bool) -> None:
+    neo4j = get_neo4j_client()
+    try:
+        neo4j.upsert_user_campaign_intents(
+            [
+                {"user_id": user_id, "campaign_id": campaign_id, "intent": intent, "count": n}
+                for (user_id, campaign_id, intent), n in deltas.items()
+            ],
+            single_transaction=True,
+        )
+    finally:
+        neo4j.close()
+
+
+_WRITERS = (
+    ("mongodb", _write_mongodb),
+    ("milvus", _write_milvus),
+    ("sqlite", _write_sqlite),
+    ("neo4j", _write_neo4j),
+)
+
+
+class EventIngestor:
+    """Bounded ingest queue + embed worker + write-behind flusher (one per API process)."""
+
+    def __init__(self):
+        self.run_id = f"events-{uuid.uuid4()}"
+        self.buffer = WriteBehindBuffer()
+        self._queue: queue.Queue[ConversationRecord] = queue.Queue(maxsize=settings.events_queue_size)
+        self._stop = threading.Event()
+        self._flush_requested = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._threads: list[threading.Thread] = []
+        self._counts = Counter()
+
+    def start(self) -> None:
+        if self._threads:
+            return
+        self._stop.clear()
+        self._threads = [
+            threading.Thread(target=self._embed_loop, name="events-embed", daemon=True),
+            threading.Thread(target=self._flush_loop, name="events-flush", daemon=True),
+        ]
+        for t in self._threads:
+            t.start()
+
+    def stop(self) -> None:
+        """Drain the queue, flush what is pending and stop the workers."""
+        self._stop.set()
+        self._flush_requested.set()
+        for t in self._threads:
+            t.join()
+        self._threads = []
+        self.flush()
+
+    def submit(self, records: list[ConversationRecord]) -> int:
+        """Enqueue events without touching any datastore; raises IngestQueueFull when over capacity."""
+        if self._queue.qsize() + len(records) > self._queue.maxsize > 0:
+            self._counts["rejected"] += len(records)
+            raise IngestQueueFull(f"queue holds {self._queue.qsize()} of {self._queue.maxsize} events")
+        accepted = 0
+        try:
+            for r in records:
+                if not r.message_id:
+                    r.message_id = str(uuid.uuid4())
+                self._queue.put_nowait(r)
+                accepted += 1
+        except queue.Full:
+            self._counts["rejected"] += len(records) - accepted
+            raise IngestQueueFull(f"accepted {accepted} of {len(records)} events")
+        finally:
+            self._counts["accepted"] += accepted
+        return accepted
+
+    def _next_batch(self) -> list[ConversationRecord]:
+        try:
+            batch = [self._queue.get(timeout=0.2)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + settings.events_embed_max_wait_ms / 1000
+        while len(batch) < settings.events_embed_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _embed_loop(self) -> None:
+        while not (self._stop.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            if not batch:
+                continue
+            try:
+                enriched = generate_embeddings(batch, self.run_id)
+            except Exception as e:
+                self._counts["dropped"] += len(batch)
+                log_anomaly("events_embed_failed", str(e), run_id=self.run_id, count=len(batch))
+                continue
+            self._counts["embedded"] += len(enriched)
+            if self.buffer.add(enriched) >= settings.events_flush_max_records:
+                self._flush_requested.set()
+
+    def _flush_loop(self) -> None:
+        while not self._stop.is_set():
+            self._flush_requested.wait(timeout=settings.events_flush_interval_seconds)
+            self._flush_requested.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("events_flush_error", run_id=self.run_id)
+
+    def flush(self) -> int:
+        """Write pending deltas in one batch per store; returns the number of vectors flushed."""
+        with self._flush_lock:
+            batch = self.buffer.drain()
+            if not any(batch.values()):
+                return 0
+            flush_id = f"{self.run_id}-{uuid.uuid4().hex[:8]}"
+            started = datetime.utcnow()
+            failed = []
+            for name, write in _WRITERS:
+                data = batch[name]
+                if not data:
+                    continue
+                try:
+                    with measure_latency(f"events_flush_{name}", run_id=flush_id, count=len(data)):
+                        write(data, flush_id, self.buffer.retrying(name))
+                except Exception as e:
+                    failed.append(name)
+                    log_anomaly("events_flush_failed", str(e), run_id=flush_id, store=name, count=len(data))
+                    if not self.buffer.restore(name, data):
+                        self._counts["write_dropped"] += len(data)
+                        log_anomaly("events_writes_dropped", str(e), run_id=flush_id, store=name, count=len(data))
+                else:
+                    self.buffer.written(name)
+            users = {r.user_id for r in batch["milvus"]} | {user_id for user_id, _ in batch["sqlite"]}
+            invalidate_local_caches(users)
+            if batch["mongodb"] and "mongodb" not in failed:
+                try:
+                    register_known_users({r.user_id for r in batch["mongodb"]})
+                except Exception as e:
+                    log_anomaly("known_users_update_failed", str(e), run_id=flush_id)
+            try:
+                invalidate_recommendations(users)
+            except Exception as e:
+                log_anomaly("cache_invalidation_failed", str(e), run_id=flush_id, users=len(users))
+            flushed = 0 if "milvus" in failed else len(batch["milvus"])
+            self._counts["flushed"] += flushed
+            try:
+                record_lineage(flush_id, "events_flush", flushed, "failed" if failed else "success", started, datetime.utcnow())
+            except Exception as e:
+                log_anomaly("lineage_failed", str(e), run_id=flush_id)
+            log_pipeline_stage("events_flush", run_id=flush_id, count=flushed, users=len(users), failed=failed)
+            return flushed
+
+    def stats(self) -> dict:
+        return {
+            **{k: self._counts[k] for k in ("accepted", "rejected", "embedded", "dropped", "flushed", "write_dropped")},
+            "queue_depth": self._queue.qsize(),
+            "pending_flush": self.buffer.pending(),
+        }
+
+
+ingestor = EventIngestor()
@@ -0,0 +1,231 @@
+"""Open-loop load test of GET /recommendations against in-memory stand-ins for the datastores.
+
+Replaces the drivers underneath src/db (Redis client, pymilvus Collection, Neo4j driver) in this
+process and points SQLite at a temporary file, so the serving code runs unchanged: admission gate,
+threadpool, per-backend guards, caches and ranking. Every Milvus call sleeps `backend_latency_ms`
+and fails at `backend_error_rate`, so goodput is bounded by BACKEND_MILVUS_MAX_CONCURRENCY and the
+latency. Never import this from the API; run it on its own:
+
+    python -m src.api.loadtest [--rates 20 100 500] [--error-rate 1.0]
+"""
+import argparse
+import asyncio
+import random
+import tempfile
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+from fastapi import HTTPException
+
+from src.api import main
+from src.api.admission import admission_stats, reset_admission
+from src.db import milvus_client, neo4j_client, redis_client
+from src.utils.config import settings
+from src.utils.logger import logger
+
+
+class _FakeRedis:
+    """The handful of Redis commands the recommendations path uses, over one shared dict."""
+
+    def __init__(self, store: dict, lock: threading.Lock):
+        self._store = store
+        self._lock = lock
+
+    def get(self, key):
+        with self._lock:
+            return self._store.get(key)
+
+    def mget(self, *keys):
+        with self._lock:
+            return [self._store.get(k) for k in keys]
+
+    def set(self, key, value, nx=False, ex=None):
+        with self._lock:
+            if nx and key in self._store:
+                return None
+            self._store[key] = value
+            return True
+
+    def setex(self, key, seconds, value):
+        return self.set(key, value)
+
+    def delete(self, *keys):
+        with self._lock:
+            return sum(self._store.pop(k, None) is not None for k in keys)
+
+    def hgetall(self, key):
+        with self._lock:
+            return dict(self._store.get(key) or {})
+
+    def pipeline(self, transaction=True):
+        return _FakePipeline(self)
+
+
+class _FakePipeline:
+    def __init__(self, client: _FakeRedis):
+        self._client = client
+        self._calls = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self._calls.append((name, args, kwargs))
+            return self
+
+        return queue
+
+    def execute(self):
+        return [getattr(self._client, name)(*args, **kwargs) for name, args, kwargs in self._calls]
+
+
+class _Backend:
+    """Latency and failures injected into every Milvus call."""
+
+    def __init__(self, latency_ms: float, error_rate: float, seed: int):
+        self.latency_seconds = latency_ms / 1000
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+
+    def call(self) -> None:
+        time.sleep(self.latency_seconds)
+        if self._rng.random() < self.error_rate:
+            raise RuntimeError("stubbed Milvus failure")
+
+
+class _Hit:
+    def __init__(self, user_id: str, distance: float):
+        self.entity = {"user_id": user_id}
+        self.distance = distance
+
+
+class _Hits(list):
+    @property
+    def ids(self):
+        return [h.entity["user_id"] for h in self]
+
+
+def _fake_collection(backend: _Backend, neighbours: int):
+    class _FakeCollection:
+        partitions: list = []
+
+        def __init__(self, name: str):
+            self.name = name
+
+        def load(self, **kwargs):
+            pass
+
+        def query(self, expr, output_fields, **kwargs):
+            backend.call()
+            return [{"embedding": [1.0] * settings.embedding_dim}]
+
+        def search(self, data, anns_field, param, limit, expr=None, output_fields=None, **kwargs):
+            backend.call()
+            return [_Hits(_Hit(f"neighbour_{i}", 1.0 - i / (neighbours + 1)) for i in range(min(limit, neighbours)))]
+
+    return _FakeCollection
+
+
+class _FakeSession:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def run(self, query, user_ids=(), limit=10000, **kwargs):
+        return [{"user_id": u, "campaign_id": f"campaign_{i}", "engagement": 1} for i, u in enumerate(user_ids)][:limit]
+
+
+class _FakeDriver:
+    def session(self):
+        return _FakeSession()
+
+    def close(self):
+        pass
+
+
+def install_fake_datastores(backend_latency_ms: float, backend_error_rate: float, seed: int = 0) -> None:
+    """Swap the drivers under src/db for in-memory stand-ins (this process only)."""
+    store, lock = {}, threading.Lock()
+    redis_client._clients[True] = redis_client._clients[False] = _FakeRedis(store, lock)
+    backend = _Backend(backend_latency_ms, backend_error_rate, seed)
+    milvus_client.connections = SimpleNamespace(connect=lambda **kwargs: None)
+    milvus_client.utility = SimpleNamespace(has_collection=lambda name: True)
+    milvus_client.Collection = _fake_collection(backend, settings.ranking_similar_users * 2)
+    neo4j_client.GraphDatabase = SimpleNamespace(driver=lambda *args, **kwargs: _FakeDriver())
+    settings.sqlite_path = str(Path(tempfile.mkdtemp(prefix="loadtest-")) / "analytics.db")
+    redis_client.cache_popular_campaigns(
+        [{"campaign_id": f"campaign_{i}", "engagement_score": 100 - i} for i in range(settings.cold_start_campaigns)]
+    )
+
+
+async def _run(rate: float, duration_seconds: float, top: int) -> dict:
+    outcomes, latencies = Counter(), []
+
+    async def one(i: int) -> None:
+        start = time.perf_counter()
+        try:
+            body = await main.recommendations(f"loadtest_{rate}_{i}", top)
+            outcome = "degraded" if body.get("degraded") else "ok"
+        except HTTPException as e:
+            outcome = "rejected" if e.status_code == 503 else "error"
+        outcomes[outcome] += 1
+        if outcome == "ok":
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    loop = asyncio.get_running_loop()
+    requests = int(rate * duration_seconds)
+    tasks = []
+    t0 = loop.time()
+    for i in range(requests):
+        delay = t0 + i / rate - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(one(i)))
+    await asyncio.gather(*tasks)
+    elapsed = loop.time() - t0
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]).round(1).tolist() if latencies else (0.0, 0.0, 0.0)
+    return {
+        "rate": rate,
+        "requests": requests,
+        **{k: outcomes[k] for k in ("ok", "degraded", "rejected", "error")},
+        "goodput_per_s": round(outcomes["ok"] / elapsed, 1),
+        "p50_ms": p50,
+        "p95_ms": p95,
+        "p99_ms": p99,
+        "milvus_circuit": admission_stats()["backends"]["milvus"]["circuit"],
+    }
+
+
+def run_load_test(
+    rates: tuple[float, ...] = (20, 100, 500),
+    duration_seconds: float = 3.0,
+    backend_latency_ms: float = 100.0,
+    backend_error_rate: float = 0.0,
+    top: int = 5,
+    seed: int = 0,
+) -> list[dict]:
+    """Outcome counts, goodput and p50/p95/p99 of full answers at each request rate; every rate
+    starts with fresh admission counters, bulkheads and closed circuits."""
+    install_fake_datastores(backend_latency_ms, backend_error_rate, seed)
+    report = []
+    for rate in rates:
+        reset_admission()
+        row = asyncio.run(_run(rate, duration_seconds, top))
+        logger.info("admission_load_test", **row)
+        report.append(row)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test GET /recommendations against in-memory datastores.")
+    parser.add_argument("--rates", type=float, nargs="+", default=[20, 100, 500], help="Requests per second")
+    parser.add_argument("--duration", type=float, default=3.0, help="Seconds per rate")
+    parser.add_argument("--latency-ms", type=float, default=100.0, help="Latency of each Milvus call")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of Milvus calls that fail")
+    args = parser.parse_args()
+    for row in run_load_test(tuple(args.rates), args.duration, args.latency_ms, args.error_rate):
+        print(row)
@@ -1,34 +1,107 @@
-"""FastAPI app: GET /recommendations/<user_id> hybrid retrieval."""
+"""FastAPI app: GET /recommendations/<user_id> hybrid retrieval, POST /events real-time ingestion."""
+import time
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 
-from src.api.recommendations import get_recommendations_for_user
+from src.api.admission import Overloaded, request_gate, admission_stats
+from src.api.events import ingestor, IngestQueueFull
+from src.api.recommendations import get_recommendations_for_user, cold_start_recommendations, cache_stats
 from src.utils.logger import logger
+from src.utils.schemas import ConversationRecord
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    ingestor.start()
+    yield
+    ingestor.stop()
+
 
 app = FastAPI(
     title="Personalization Recommendations API",
     description="Hybrid retrieval: vector (Milvus) + graph (Neo4j) + analytics (SQLite), cached with Redis",
+    lifespan=lifespan,
 )
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
 
 
+def _recommendations_or_log(user_id: str, top: int) -> list[dict]:
+    """Runs on the threadpool, so rendering an error's traceback never stalls the event loop."""
+    try:
+        return get_recommendations_for_user(user_id, top)
+    except Overloaded:
+        raise
+    except Exception:
+        logger.exception("recommendations_error", user_id=user_id)
+        raise
+
+
 @app.get("/recommendations/{user_id}")
-def recommendations(user_id: str, top: int = 5):
+async def recommendations(user_id: str, top: int = 5):
     """
     Return top recommended campaigns for user_id.
 
-    Flow: (1) Retrieve top 5 most similar users via Milvus vector search.
-    (2) Fetch campaigns connected to those users via Neo4j.
-    (3) Rank and return results by engagement frequency from the analytics DB.
+    Flow: (1) Retrieve the most similar users (with similarity scores) via Milvus vector search.
+    (2) Fetch each neighbour's campaign engagement via Neo4j.
+    (3) Score candidates by similarity-weighted votes plus global engagement (analytics DB),
+    optionally decayed by recency, and return the top results.
+
+    Requests are admitted through a bounded gate before taking a threadpool thread. When the
+    gate or a datastore sheds load, the response is the cold-start list marked `degraded`,
+    or 503 if there is none.
     """
     if not user_id.strip():
         raise HTTPException(status_code=400, detail="user_id required")
+    top = min(top, 20)
+    start = time.perf_counter()
     try:
-        results = get_recommendations_for_user(user_id, top_campaigns=min(top, 20))
-        return {"user_id": user_id, "recommendations": results}
+        async with request_gate.admit():
+            results = await run_in_threadpool(_recommendations_or_log, user_id, top)
+    except Overloaded as e:
+        fallback = cold_start_recommendations(top)
+        if not fallback:
+            request_gate.observe("rejected", time.perf_counter() - start)
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+        request_gate.observe("degraded", time.perf_counter() - start)
+        return {"user_id": user_id, "recommendations": fallback, "degraded": True}
     except Exception as e:
-        logger.exception("recommendations_error", user_id=user_id)
+        request_gate.observe("error", time.perf_counter() - start)  # logged on the worker thread
         raise HTTPException(status_code=500, detail=str(e))
+    request_gate.observe("ok", time.perf_counter() - start)
+    return {"user_id": user_id, "recommendations": results}
+
+
+@app.post("/events", status_code=202)
+async def events(payload: ConversationRecord | list[ConversationRecord]):
+    """
+    Accept one event or a batch of events (same shape as pipeline input records).
+
+    Events are queued for micro-batched embedding and written to the stores by the
+    write-behind flusher; nothing is written per request.
+    """
+    records = payload if isinstance(payload, list) else [payload]
+    if not records:
+        raise HTTPException(status_code=400, detail="at least one event required")
+    try:
+        accepted = ingestor.submit(records)
+    except IngestQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    return {"accepted": accepted}
+
+
+@app.get("/events/stats")
+def events_stats():
+    return ingestor.stats()
+
+
+@app.get("/stats")
+def stats():
+    """Recommendations path counters for this worker process: per-layer cache hit rates, known-user
+    filter, and admission control (request outcomes, tail latency, backend limits and circuits)."""
+    return {"caches": cache_stats(), "admission": admission_stats()}
 
 
 @app.get("/health")
@@ -1,4 +1,23 @@
-"""Hybrid retrieval: Milvus (similar users) -> Neo4j (campaigns) -> SQLite (rank by engagement)."""
+"""Hybrid retrieval: Milvus (similar users) -> Neo4j (campaigns) -> SQLite (rank by engagement).
+
+Besides the Redis response cache, each worker keeps in-process caches of the intermediates: the
+user's profile embedding, their similar users, and the campaign edges/stats for a neighbour set.
+All are keyed by the pipeline data version, and the user's own intermediates also by the user
+version that each events flush stamps in Redis, so every worker drops them when the user's events
+land. Neighbour campaigns, which depend on other users' events, live no longer than the Redis
+soft TTL. Neighbour lists have their own, longer bound (local_cache_similar_users_ttl_seconds) so
+that stale-while-revalidate refreshes and response-cache misses can re-rank from them instead of
+calling Milvus and Neo4j again.
+
+Users not in the known-users Bloom filter (built by the pipeline) get the precomputed popular
+campaigns without any datastore call. Every datastore call runs under that backend's admission
+guard, so a slow or failing store raises BackendUnavailable instead of queueing requests.
+"""
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 from pymilvus import Collection
 
@@ -7,16 +26,142 @@ from src.db import (
     get_neo4j_client,
     get_connection,
     init_analytics_schema,
-    get_campaign_engagement_ranked,
+    get_campaign_engagement_stats,
     get_cached_recommendations,
     cache_recommendations,
+    claim_refresh,
+    hot_partition_names,
+    load_known_users,
+    add_known_users,
+    get_popular_campaigns,
+)
+from src.api.admission import BackendUnavailable, guard
+from src.api.ranking import rank_campaigns
+from src.pipeline.compression import to_query_space
+from src.utils.cache import TTLCache
+from src.utils.config import settings
+from src.utils.logger import logger, measure_latency, log_anomaly
+
+_refresh_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="recs-refresh")
+
+# (data_version, user_version, user_id) -> float32 profile embedding, or _NO_EMBEDDING
+_NO_EMBEDDING = object()
+_embedding_cache = TTLCache(
+    "user_embedding",
+    settings.local_cache_embedding_max_entries,
+    min(settings.local_cache_embedding_ttl_seconds, settings.redis_ttl_seconds),  # user version key outlives it
 )
-from src.utils.logger import measure_latency, log_anomaly
+# (data_version, user_version, user_id) -> [(user_id, similarity)]
+# Not capped at the soft TTL: stale-while-revalidate refreshes and response-cache misses re-rank
+# from these neighbours. Their staleness is bounded by local_cache_similar_users_ttl_seconds alone.
+_similar_users_cache = TTLCache(
+    "similar_users",
+    settings.local_cache_similar_users_max_entries,
+    settings.local_cache_similar_users_ttl_seconds,
+)
+# (data_version, neighbour ids) -> (neighbour-campaign edges, campaign engagement stats)
+_campaigns_cache = TTLCache(
+    "neighbour_campaigns",
+    settings.local_cache_campaigns_max_entries,
+    min(settings.local_cache_campaigns_ttl_seconds, settings.redis_soft_ttl_seconds),
+)
+_response_counts = Counter()
+
+
+class _KnownUsers:
+    """
+    This worker's copy of the known-users filter and the cold-start list. Loaded on first use,
+    then reloaded in the background when the data version changes or every
+    known_users_refresh_seconds. Until the pipeline has built a filter, every user counts as known.
+    """
+
+    def __init__(self):
+        self._filter = None
+        self._users = 0
+        self._popular: list[dict] = []
+        self._version: int | None = None
+        self._loaded_at: float | None = None
+        self._reload_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._added: set[str] = set()  # added locally, not yet seen in a filter loaded from Redis
+        self.negative_lookups = 0
+
+    def _reload(self) -> None:
+        if not self._reload_lock.acquire(blocking=False):
+            return
+        try:
+            # The first load runs on a request thread, so it is shed like any other Redis call.
+            with guard("redis"):
+                loaded = load_known_users()
+                popular = get_popular_campaigns()
+            with self._lock:
+                self._filter, self._users = loaded if loaded else (None, 0)
+                # Keep local additions the loaded filter does not have yet (e.g. Redis was down).
+                self._added = {u for u in self._added if self._filter is not None and u not in self._filter}
+                if self._filter is not None:
+                    self._filter.update(self._added)
+                self._popular = popular
+        except Exception as e:
+            log_anomaly("known_users_load_failed", str(e))
+        finally:
+            # Also on failure, so a Redis outage is retried once per interval rather than per request.
+            self._loaded_at = time.monotonic()
+            self._reload_lock.release()
+
+    def _reload_in_background(self) -> None:
+        if not self._reload_lock.locked():
+            _refresh_executor.submit(self._reload)
+
+    def might_contain(self, user_id: str) -> bool:
+        if self._loaded_at is None:
+            self._reload()
+        elif time.monotonic() - self._loaded_at > settings.known_users_refresh_seconds:
+            self._reload_in_background()
+        bloom = self._filter
+        if bloom is None or user_id in bloom:
+            return True
+        self.negative_lookups += 1
+        return False
+
+    def observe_version(self, data_version: int) -> None:
+        """Called with the data version read alongside the response cache."""
+        previous, self._version = self._version, data_version
+        if previous is not None and previous != data_version:
+            self._reload_in_background()
+
+    def add(self, user_ids) -> list[str]:
+        """Add users to the local filter; returns those that were not in it yet."""
+        with self._lock:
+            self._added.update(user_ids)
+            bloom = self._filter
+            if bloom is None:
+                return list(user_ids)
+            new = [u for u in user_ids if u not in bloom]
+            bloom.update(new)
+            self._users += len(new)
+            return new
+
+    def popular(self, top: int) -> list[dict]:
+        return self._popular[:top]
+
+    def stats(self) -> dict:
+        bloom = self._filter
+        return {
+            "loaded": bloom is not None,
+            "users": self._users,
+            "bits": bloom.num_bits if bloom else 0,
+            "hashes": bloom.num_hashes if bloom else 0,
+            "fill_ratio": round(bloom.fill_ratio(), 4) if bloom else 0.0,
+            "negative_lookups": self.negative_lookups,
+            "cold_start_campaigns": len(self._popular),
+        }
+
+
+_known_users = _KnownUsers()
 
 
 def _get_user_embedding(collection: Collection, user_id: str) -> list[float] | None:
-    """Return mean embedding for user's messages, or None if not found."""
-    collection.load()
+    """Return mean embedding for all of the user's messages, or None if not found."""
     expr = f'user_id == "{user_id}"'
     res = collection.query(expr=expr, output_fields=["embedding"])
     if not res:
@@ -34,75 +179,189 @@ def _get_user_embedding(collection: Collection, user_id: str) -> list[float] | N
     return arr.mean(axis=0).tolist()
 
 
-def get_similar_user_ids(collection: Collection, query_embedding: list[float], top_k: int = 5) -> list[str]:
-    """Return top_k user_ids by vector similarity (excluding query user if present)."""
-    collection.load()
+def get_similar_users(
+    collection: Collection, query_embedding: list[float], top_k: int = 5, exclude_user_id: str | None = None
+) -> list[tuple[str, float]]:
+    """
+    Return top_k (user_id, similarity) by vector search over the search window, keeping each
+    user's best hit and excluding the query user (whose own vectors would rank first).
+    """
+    partitions = hot_partition_names(collection)
+    if partitions == []:
+        return []
     results = collection.search(
-        data=[query_embedding],
+        data=[to_query_space(query_embedding, collection.name)],
         anns_field="embedding",
         param={"metric_type": "IP", "params": {"nprobe": 16}},
         limit=top_k * 3,
+        expr=f'user_id != "{exclude_user_id}"' if exclude_user_id else None,
+        output_fields=["user_id"],
+        partition_names=partitions,
     )
     if not results or not results[0].ids:
         return []
-    ids = results[0].ids
-    id_list = [int(x) for x in ids]
-    id_str = ",".join(str(x) for x in id_list)
-    user_res = collection.query(expr=f"id in [{id_str}]", output_fields=["user_id"])
-    user_ids = []
-    seen = set()
-    for r in (user_res or []):
-        uid = r.get("user_id")
-        if uid and uid not in seen:
-            seen.add(uid)
-            user_ids.append(uid)
-            if len(user_ids) >= top_k:
+    best: dict[str, float] = {}
+    for hit in results[0]:
+        uid = hit.entity.get("user_id")
+        if uid and uid != exclude_user_id and uid not in best:
+            # Hits come back ordered by similarity, so the first hit per user is its best.
+            best[uid] = float(hit.distance)
+            if len(best) >= top_k:
                 break
-    return user_ids
+    return list(best.items())
+
+
+def get_similar_user_ids(
+    collection: Collection, query_embedding: list[float], top_k: int = 5, exclude_user_id: str | None = None
+) -> list[str]:
+    """Return top_k user_ids by vector similarity (excluding the query user)."""
+    return [uid for uid, _ in get_similar_users(collection, query_embedding, top_k, exclude_user_id)]
 
 
 def get_recommendations_for_user(user_id: str, top_campaigns: int = 5) -> list[dict]:
     """
-    Retrieve top 5 most similar users (Milvus), fetch their campaigns (Neo4j),
-    return results ranked by engagement frequency (analytics DB). Uses Redis cache.
+    Retrieve the most similar users (Milvus), fetch their campaigns (Neo4j), and rank
+    by similarity-weighted votes plus global engagement (analytics DB). Uses Redis cache.
+
+    Entries past their soft expiry are returned immediately while one background
+    task per user recomputes them (stale-while-revalidate). Users that are not in the
+    known-users filter get the precomputed popular campaigns without any datastore call.
     """
-    cached = get_cached_recommendations(user_id)
-    if cached is not None:
-        return cached
-
-    coll = get_collection()
-    with measure_latency("get_user_embedding", user_id=user_id):
-        query_emb = _get_user_embedding(coll, user_id)
-    if not query_emb:
-        log_anomaly("missing_embedding", f"No embedding for user_id={user_id}", user_id=user_id)
-        return []
+    if not _known_users.might_contain(user_id):
+        return _known_users.popular(top_campaigns)
+    with guard("redis"):
+        cached = get_cached_recommendations(user_id)
+    _known_users.observe_version(cached.data_version)
+    if cached.payload is not None:
+        _response_counts["stale" if cached.stale else "hits"] += 1
+        if cached.stale:
+            _schedule_refresh(user_id, top_campaigns, cached.data_version, cached.user_version)
+        return cached.payload
+    _response_counts["misses"] += 1
+    return _compute_recommendations(user_id, top_campaigns, cached.data_version, cached.user_version)
+
+
+def cold_start_recommendations(top_campaigns: int = 5) -> list[dict]:
+    """Precomputed popular campaigns, from memory (the degraded answer under overload)."""
+    return _known_users.popular(top_campaigns)
+
+
+def _schedule_refresh(user_id: str, top_campaigns: int, data_version: int, user_version: int) -> None:
+    try:
+        with guard("redis"):
+            claimed = claim_refresh(user_id)
+    except BackendUnavailable:
+        return  # keep serving the stale entry
+    if claimed:
+        _refresh_executor.submit(_refresh_recommendations, user_id, top_campaigns, data_version, user_version)
+
+
+def _refresh_recommendations(user_id: str, top_campaigns: int, data_version: int, user_version: int) -> None:
+    try:
+        with measure_latency("recommendations_refresh", user_id=user_id):
+            _compute_recommendations(user_id, top_campaigns, data_version, user_version)
+    except BackendUnavailable as e:
+        log_anomaly("recommendations_refresh_shed", str(e), user_id=user_id)
+    except Exception:
+        logger.exception("recommendations_refresh_error", user_id=user_id)
+
 
-    with measure_latency("milvus_similar_users", user_id=user_id):
-        similar_users = get_similar_user_ids(coll, query_emb, top_k=5)
+def _campaign_candidates(neighbour_ids: list[str]) -> tuple[list[dict], list[tuple]]:
+    """Neighbour-campaign edges (Neo4j) and engagement stats of those campaigns (analytics DB)."""
+    with guard("neo4j"):
+        neo4j = get_neo4j_client()
+        try:
+            with measure_latency("neo4j_campaigns", neighbours=len(neighbour_ids)):
+                edges = neo4j.get_user_campaign_engagements(neighbour_ids, limit=settings.ranking_max_candidates)
+        finally:
+            neo4j.close()
+    if not edges:
+        return [], []
+    with guard("sqlite"):
+        conn = get_connection()
+        init_analytics_schema(conn)
+        return edges, get_campaign_engagement_stats(conn, list({e["campaign_id"] for e in edges}))
+
+
+def _compute_recommendations(user_id: str, top_campaigns: int, data_version: int, user_version: int = 0) -> list[dict]:
+    """Hybrid retrieval from cached intermediates where possible; caches the result stamped with
+    the data version it was computed against."""
+    user_key = (data_version, user_version, user_id)
+    similar_users = _similar_users_cache.get(user_key)
+    if similar_users is None:
+        query_emb = _embedding_cache.get(user_key)
+        if query_emb is _NO_EMBEDDING:
+            _known_users.negative_lookups += 1
+            return _known_users.popular(top_campaigns)
+        with guard("milvus"):
+            coll = get_collection()
+            if query_emb is None:
+                with measure_latency("get_user_embedding", user_id=user_id):
+                    query_emb = _get_user_embedding(coll, user_id)
+                if not query_emb:
+                    log_anomaly("missing_embedding", f"No embedding for user_id={user_id}", user_id=user_id)
+                    # Known (e.g. a Bloom false positive) but no vectors: skip Milvus until the user's events land.
+                    _embedding_cache.set(user_key, _NO_EMBEDDING)
+                    return _known_users.popular(top_campaigns)
+                query_emb = np.asarray(query_emb, dtype=np.float32)
+                _embedding_cache.set(user_key, query_emb)
+            with measure_latency("milvus_similar_users", user_id=user_id):
+                similar_users = get_similar_users(
+                    coll, query_emb.tolist(), top_k=settings.ranking_similar_users, exclude_user_id=user_id
+                )
+        _similar_users_cache.set(user_key, similar_users)
     if not similar_users:
         log_anomaly("no_similar_users", f"user_id={user_id}", user_id=user_id)
         return []
 
-    neo4j = get_neo4j_client()
-    with measure_latency("neo4j_campaigns", user_id=user_id):
-        campaigns = neo4j.get_campaigns_for_users(similar_users, limit=20)
-    neo4j.close()
-
-    if not campaigns:
+    neighbours = tuple(sorted(uid for uid, _ in similar_users))
+    edges, stats = _campaigns_cache.get_or_compute((data_version, neighbours), lambda: _campaign_candidates(list(neighbours)))
+    if not edges:
         log_anomaly("missing_relationships", f"No campaigns for similar users, user_id={user_id}", user_id=user_id)
         return []
 
-    campaign_ids = [c["campaign_id"] for c in campaigns]
-    conn = get_connection()
-    init_analytics_schema(conn)
-    ranked = get_campaign_engagement_ranked(conn, campaign_ids)
-    engagement_by_campaign = {c["campaign_id"]: c["engagement"] for c in campaigns}
-    for cid, total in ranked:
-        engagement_by_campaign[cid] = engagement_by_campaign.get(cid, 0) + total
-    sorted_campaigns = sorted(
-        engagement_by_campaign.items(),
-        key=lambda x: -x[1],
-    )[:top_campaigns]
-    result = [{"campaign_id": cid, "engagement_score": score} for cid, score in sorted_campaigns]
-    cache_recommendations(user_id, result)
+    with measure_latency("rank_campaigns", user_id=user_id, candidates=len(stats)):
+        result = rank_campaigns(similar_users, edges, stats, top_campaigns)
+    try:
+        with guard("redis"):
+            cache_recommendations(user_id, result, data_version)
+    except BackendUnavailable:
+        pass  # the result is still good; it just is not cached
     return result
+
+
+def invalidate_local_caches(user_ids) -> None:
+    """
+    Drop this worker's intermediates that involve these users right away. Other workers drop the
+    users' own intermediates through the user version, neighbour campaigns within the soft TTL and
+    neighbour lists within the similar-users TTL.
+    """
+    users = set(user_ids)
+    if not users:
+        return
+    _embedding_cache.discard(lambda key: key[2] in users)
+    _similar_users_cache.discard(lambda key: key[2] in users)
+    _campaigns_cache.discard(lambda key: not users.isdisjoint(key[1]))
+
+
+def register_known_users(user_ids) -> None:
+    """Add users whose events were just stored to this worker's filter and the shared one in Redis."""
+    users = set(user_ids)
+    new = _known_users.add(users)
+    # All of them, not only the new ones: a rebuild that started before their events were stored
+    # merges exactly the users recorded here.
+    add_known_users(users, new=len(new))
+
+
+def cache_stats() -> dict:
+    """Hit rates of the Redis response cache and of each in-process intermediate layer."""
+    lookups = sum(_response_counts.values())
+    served = _response_counts["hits"] + _response_counts["stale"]
+    return {
+        "response": {
+            **{k: _response_counts[k] for k in ("hits", "stale", "misses")},
+            "hit_rate": round(served / lookups, 4) if lookups else 0.0,
+        },
+        **{c.name: c.stats() for c in (_embedding_cache, _similar_users_cache, _campaigns_cache)},
+        "known_users": _known_users.stats(),
+    }
@@ -1,25 +1,76 @@
-from .mongodb import get_mongo_client, get_conversations_collection, ensure_indexes
-from .milvus_client import connect_milvus, get_collection, create_collection_if_not_exists, insert_vectors
+from .mongodb import get_mongo_client, get_conversations_collection, get_backfill_checkpoints_collection, ensure_indexes
+from .milvus_client import (
+    connect_milvus,
+    get_collection,
+    create_collection_if_not_exists,
+    insert_vectors,
+    existing_message_ids,
+    get_active_collection_name,
+    set_active_collection_name,
+    partition_for,
+    hot_partition_names,
+    apply_partition_retention,
+)
 from .neo4j_client import Neo4jClient, get_neo4j_client
-from .sqlite_analytics import get_connection, init_analytics_schema, upsert_engagement, get_campaign_engagement_ranked, record_pipeline_run
-from .redis_client import get_redis_client, cache_recommendations, get_cached_recommendations
+from .sqlite_analytics import get_connection, init_analytics_schema, upsert_engagement, upsert_engagement_many, get_campaign_engagement_ranked, get_campaign_engagement_stats, get_top_campaigns, record_pipeline_run
+from .redis_client import (
+    CachedRecommendations,
+    get_redis_client,
+    cache_recommendations,
+    get_cached_recommendations,
+    get_data_version,
+    bump_data_version,
+    claim_refresh,
+    invalidate_recommendations,
+    cache_popular_campaigns,
+    get_popular_campaigns,
+    publish_compressor,
+    get_collection_compressor,
+    get_compressor_blob,
+    save_known_users,
+    load_known_users,
+    add_known_users,
+)
 
 __all__ = [
     "get_mongo_client",
     "get_conversations_collection",
+    "get_backfill_checkpoints_collection",
     "ensure_indexes",
     "connect_milvus",
     "get_collection",
     "create_collection_if_not_exists",
     "insert_vectors",
+    "existing_message_ids",
+    "get_active_collection_name",
+    "set_active_collection_name",
+    "partition_for",
+    "hot_partition_names",
+    "apply_partition_retention",
     "Neo4jClient",
     "get_neo4j_client",
     "get_connection",
     "init_analytics_schema",
     "upsert_engagement",
+    "upsert_engagement_many",
     "get_campaign_engagement_ranked",
+    "get_campaign_engagement_stats",
+    "get_top_campaigns",
     "record_pipeline_run",
     "get_redis_client",
     "cache_recommendations",
     "get_cached_recommendations",
+    "CachedRecommendations",
+    "get_data_version",
+    "bump_data_version",
+    "claim_refresh",
+    "invalidate_recommendations",
+    "cache_popular_campaigns",
+    "get_popular_campaigns",
+    "publish_compressor",
+    "get_collection_compressor",
+    "get_compressor_blob",
+    "save_known_users",
+    "load_known_users",
+    "add_known_users",
 ]
@@ -1,15 +1,39 @@
-"""Milvus connection and vector collection setup."""
+"""Milvus connection and vector collection setup.
+
+The collection served to readers and writers is named by a pointer in Redis (set when a
+backfill finishes), falling back to settings.milvus_collection. Swapping the pointer is a
+single SET, so readers move to a rebuilt collection without downtime.
+
+Vectors are written to time-bucketed partitions (t_YYYYMMDD, the bucket's first day) derived
+from the message timestamp. The whole collection stays loaded, so a user's own vectors are
+found in any bucket; the optional search window only narrows the neighbour search to recent
+buckets. Buckets past the retention period are dropped.
+"""
+import json
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+
 from pymilvus import (
     connections,
     Collection,
     CollectionSchema,
+    Partition,
     FieldSchema,
     DataType,
     utility,
 )
+from src.db.redis_client import get_redis_client
 from src.utils.config import settings
 from src.utils.logger import log_anomaly
 
+ACTIVE_COLLECTION_KEY = "meta:milvus:active_collection"
+ACTIVE_NAME_TTL_SECONDS = 5.0
+_active = {"name": None, "checked_at": 0.0}
+_HOT_PARTITIONS_TTL_SECONDS = 60.0
+_hot_partitions: dict[str, tuple[float, list[str] | None]] = {}
+_PARTITION_PREFIX = "t_"
+
 
 def connect_milvus():
     connections.connect(
@@ -19,11 +43,37 @@ def connect_milvus():
     )
 
 
-def create_collection_if_not_exists():
+def _index_params() -> dict:
+    # int8 scalar quantization maps onto Milvus' own SQ8 index; float16 is stored as float32.
+    index_type = "IVF_SQ8" if settings.vector_quantization == "int8" else "IVF_FLAT"
+    return {"metric_type": "IP", "index_type": index_type, "params": {"nlist": 128}}
+
+
+def get_active_collection_name() -> str:
+    """Collection currently served; re-read from Redis at most every few seconds."""
+    now = time.monotonic()
+    if _active["name"] is None or now - _active["checked_at"] > ACTIVE_NAME_TTL_SECONDS:
+        try:
+            name = get_redis_client().get(ACTIVE_COLLECTION_KEY)
+        except Exception as e:
+            log_anomaly("active_collection_lookup_failed", str(e))
+            name = _active["name"]
+        _active.update(name=name or settings.milvus_collection, checked_at=now)
+    return _active["name"]
+
+
+def set_active_collection_name(name: str) -> None:
+    """Atomically point every reader and writer at `name`."""
+    get_redis_client().set(ACTIVE_COLLECTION_KEY, name)
+    _active.update(name=name, checked_at=time.monotonic())
+
+
+def create_collection_if_not_exists(dim: int | None = None, name: str | None = None):
     connect_milvus()
-    if utility.has_collection(settings.milvus_collection):
-        return Collection(settings.milvus_collection)
-    dim = settings.embedding_dim
+    name = name or get_active_collection_name()
+    if utility.has_collection(name):
+        return Collection(name)
+    dim = dim or settings.embedding_dim
     fields = [
         FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=True),
         FieldSchema(name="message_id", dtype=DataType.VARCHAR, max_length=256),
@@ -31,24 +81,113 @@ def create_collection_if_not_exists():
         FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=dim),
     ]
     schema = CollectionSchema(fields=fields, description="Conversation embeddings")
-    coll = Collection(name=settings.milvus_collection, schema=schema)
-    coll.create_index(field_name="embedding", index_params={"metric_type": "IP", "index_type": "IVF_FLAT", "params": {"nlist": 128}})
+    coll = Collection(name=name, schema=schema)
+    coll.create_index(field_name="embedding", index_params=_index_params())
     return coll
 
 
-def get_collection() -> Collection:
+def partition_for(ts: datetime) -> str:
+    """Time-bucket partition for a message timestamp (naive timestamps are UTC)."""
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc)
+    ordinal = ts.date().toordinal()
+    start = date.fromordinal(ordinal - ordinal % settings.milvus_partition_days)
+    return f"{_PARTITION_PREFIX}{start:%Y%m%d}"
+
+
+def _partition_age_days(name: str, today: date) -> int | None:
+    """Days since the bucket's last day; None for partitions that are not time buckets."""
+    if not name.startswith(_PARTITION_PREFIX):
+        return None
+    try:
+        start = datetime.strptime(name[len(_PARTITION_PREFIX):], "%Y%m%d").date()
+    except ValueError:
+        return None
+    return (today - (start + timedelta(days=settings.milvus_partition_days - 1))).days
+
+
+def hot_partition_names(collection: Collection) -> list[str] | None:
+    """
+    Time buckets inside the search window, for `partition_names=` on the neighbour search. None
+    means search the whole collection (window disabled, or a legacy collection without time
+    buckets). A non-empty `_default` (vectors from before bucketing, not yet backfilled) counts
+    as hot, since their age is unknown.
+    """
+    cached = _hot_partitions.get(collection.name)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+    hot = None
+    if settings.milvus_search_window_days > 0:
+        today = datetime.utcnow().date()
+        ages = {p.name: _partition_age_days(p.name, today) for p in collection.partitions}
+        if any(age is not None for age in ages.values()):
+            hot = [name for name, age in ages.items() if age is not None and age < settings.milvus_search_window_days]
+            if "_default" in ages and Partition(collection, "_default").num_entities:
+                hot.append("_default")
+    _hot_partitions[collection.name] = (time.monotonic() + _HOT_PARTITIONS_TTL_SECONDS, hot)
+    return hot
+
+
+def get_collection(dim: int | None = None, name: str | None = None) -> Collection:
+    """Load the active (or named) collection; `dim` is only used if it has to be created."""
     connect_milvus()
-    if not utility.has_collection(settings.milvus_collection):
-        return create_collection_if_not_exists()
-    coll = Collection(settings.milvus_collection)
+    name = name or get_active_collection_name()
+    if not utility.has_collection(name):
+        return create_collection_if_not_exists(dim, name)
+    coll = Collection(name)
     coll.load()
     return coll
 
 
-def insert_vectors(collection: Collection, message_ids: list, user_ids: list, embeddings: list[list[float]]):
+def insert_vectors(
+    collection: Collection,
+    message_ids: list,
+    user_ids: list,
+    embeddings: list[list[float]],
+    timestamps: list[datetime] | None = None,
+):
+    """Insert rows, one insert per time-bucket partition when timestamps are given."""
     if not embeddings or not message_ids:
         log_anomaly("empty_embeddings", "insert_vectors called with no data", message_ids_len=len(message_ids))
         return
-    entities = [message_ids, user_ids, embeddings]
-    collection.insert(entities)
+    if timestamps is None:
+        collection.insert([message_ids, user_ids, embeddings])
+        collection.flush()
+        return
+    rows_by_partition: dict[str, list[int]] = defaultdict(list)
+    for i, ts in enumerate(timestamps):
+        rows_by_partition[partition_for(ts)].append(i)
+    for partition, rows in rows_by_partition.items():
+        if not collection.has_partition(partition):
+            collection.create_partition(partition)
+            # Let the next neighbour search include the new bucket.
+            _hot_partitions.pop(collection.name, None)
+        collection.insert(
+            [[message_ids[i] for i in rows], [user_ids[i] for i in rows], [embeddings[i] for i in rows]],
+            partition_name=partition,
+        )
     collection.flush()
+
+
+def existing_message_ids(collection: Collection, message_ids: list[str]) -> set[str]:
+    """message_ids already stored in collection (to make a retried or overlapping insert idempotent)."""
+    if not message_ids:
+        return set()
+    res = collection.query(expr=f"message_id in {json.dumps(message_ids)}", output_fields=["message_id"])
+    return {r["message_id"] for r in res}
+
+
+def apply_partition_retention(collection: Collection) -> dict:
+    """Drop time buckets past the retention period."""
+    today = datetime.utcnow().date()
+    dropped = []
+    for p in collection.partitions:
+        age = _partition_age_days(p.name, today)
+        if age is None:
+            continue
+        if settings.milvus_retention_days > 0 and age >= settings.milvus_retention_days:
+            Partition(collection, p.name).release()
+            collection.drop_partition(p.name)
+            dropped.append(p.name)
+    _hot_partitions.pop(collection.name, None)
+    return {"dropped": dropped}
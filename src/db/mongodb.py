@@ -12,6 +12,11 @@ def get_conversations_collection():
     return client[settings.mongodb_db]["conversations"]
 
 
+def get_backfill_checkpoints_collection():
+    client = get_mongo_client()
+    return client[settings.mongodb_db]["backfill_checkpoints"]
+
+
 def ensure_indexes(collection):
     collection.create_index("user_id")
     collection.create_index("timestamp")
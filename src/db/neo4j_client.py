@@ -1,7 +1,33 @@
-"""Neo4j connection and graph operations for User–Campaign–Intent."""
+"""Neo4j connection and graph operations for User–Campaign–Intent.
+
+There is one ENGAGED_WITH edge per (user, campaign); writers MERGE the bare relationship and add
+their count to it, so the pipeline and the events flusher update the same edge.
+"""
+from operator import itemgetter
+
 from neo4j import GraphDatabase
 from src.utils.config import settings
 
+_UPSERT_ROWS = """
+UNWIND $rows AS row
+MERGE (u:User {user_id: row.user_id})
+MERGE (c:Campaign {campaign_id: row.campaign_id})
+MERGE (i:Intent {name: row.intent})
+MERGE (u)-[r:ENGAGED_WITH]->(c)
+SET r.count = coalesce(r.count, 0) + row.count
+MERGE (u)-[:HAS_INTENT]->(i)
+MERGE (c)-[:TARGETS]->(i)
+"""
+
+
+def _upsert_rows(tx, rows: list[dict]) -> None:
+    tx.run(_UPSERT_ROWS, rows=rows).consume()
+
+
+def _upsert_batches(tx, rows: list[dict], batch_size: int) -> None:
+    for start in range(0, len(rows), batch_size):
+        _upsert_rows(tx, rows[start:start + batch_size])
+
 
 class Neo4jClient:
     def __init__(self):
@@ -18,23 +44,54 @@ class Neo4jClient:
             session.run("CREATE CONSTRAINT user_id IF NOT EXISTS FOR (u:User) REQUIRE u.user_id IS UNIQUE")
             session.run("CREATE CONSTRAINT campaign_id IF NOT EXISTS FOR (c:Campaign) REQUIRE c.campaign_id IS UNIQUE")
             session.run("CREATE CONSTRAINT intent_name IF NOT EXISTS FOR (i:Intent) REQUIRE i.name IS UNIQUE")
+        self.collapse_duplicate_engagement_edges()
 
-    def upsert_user_campaign_intent(self, user_id: str, campaign_id: str, intent: str, engagement_count: int = 1):
+    def collapse_duplicate_engagement_edges(self) -> int:
+        """
+        One-off migration: merge parallel ENGAGED_WITH edges (left by the old count-keyed MERGE
+        next to incrementally updated edges) into one edge carrying their summed count.
+        """
         with self._driver.session() as session:
-            session.run(
+            if session.run("MATCH (m:Migration {name: 'engaged_with_single_edge'}) RETURN m").single():
+                return 0
+            collapsed = session.run(
                 """
-                MERGE (u:User {user_id: $user_id})
-                MERGE (c:Campaign {campaign_id: $campaign_id})
-                MERGE (i:Intent {name: $intent})
-                MERGE (u)-[:ENGAGED_WITH {count: $engagement_count}]->(c)
-                MERGE (u)-[:HAS_INTENT]->(i)
-                MERGE (c)-[:TARGETS]->(i)
-                """,
-                user_id=user_id,
-                campaign_id=campaign_id,
-                intent=intent,
-                engagement_count=engagement_count,
-            )
+                MATCH (u:User)-[r:ENGAGED_WITH]->(c:Campaign)
+                WITH u, c, collect(r) AS rels
+                WHERE size(rels) > 1
+                WITH rels, head(rels) AS keep, reduce(total = 0, x IN rels | total + coalesce(x.count, 0)) AS total
+                FOREACH (x IN tail(rels) | DELETE x)
+                SET keep.count = total
+                RETURN count(keep) AS collapsed
+                """
+            ).single()["collapsed"]
+            session.run("MERGE (:Migration {name: 'engaged_with_single_edge'})")
+            return collapsed
+
+    def upsert_user_campaign_intent(self, user_id: str, campaign_id: str, intent: str, engagement_count: int = 1):
+        """Add engagement_count to the user's ENGAGED_WITH edge."""
+        self.upsert_user_campaign_intents(
+            [{"user_id": user_id, "campaign_id": campaign_id, "intent": intent, "count": engagement_count}]
+        )
+
+    def upsert_user_campaign_intents(self, rows: list[dict], batch_size: int = 1000, single_transaction: bool = False):
+        """
+        Batched write of rows {user_id, campaign_id, intent, count}; count is added to the edge.
+
+        Each batch is a managed transaction, retried by the driver on transient errors such as
+        deadlocks between parallel writers on shared Campaign/Intent nodes. Rows are sorted so
+        concurrent writers lock nodes in the same order. With single_transaction, all batches
+        commit together, so a caller that retries after a failure never adds a count twice.
+        """
+        if not rows:
+            return
+        rows = sorted(rows, key=itemgetter("campaign_id", "intent", "user_id"))
+        with self._driver.session() as session:
+            if single_transaction:
+                session.execute_write(_upsert_batches, rows, batch_size)
+                return
+            for start in range(0, len(rows), batch_size):
+                session.execute_write(_upsert_rows, rows[start:start + batch_size])
 
     def get_campaigns_for_users(self, user_ids: list[str], limit: int = 20) -> list[dict]:
         if not user_ids:
@@ -53,6 +110,23 @@ class Neo4jClient:
             )
             return [{"campaign_id": r["campaign_id"], "engagement": r["total_engagement"]} for r in result]
 
+    def get_user_campaign_engagements(self, user_ids: list[str], limit: int = 10000) -> list[dict]:
+        """Per (user, campaign) engagement, so callers can weight each neighbour separately."""
+        if not user_ids:
+            return []
+        with self._driver.session() as session:
+            result = session.run(
+                """
+                MATCH (u:User)-[r:ENGAGED_WITH]->(c:Campaign)
+                WHERE u.user_id IN $user_ids
+                RETURN u.user_id AS user_id, c.campaign_id AS campaign_id, sum(r.count) AS engagement
+                LIMIT $limit
+                """,
+                user_ids=user_ids,
+                limit=limit,
+            )
+            return [{"user_id": r["user_id"], "campaign_id": r["campaign_id"], "engagement": r["engagement"]} for r in result]
+
 
 def get_neo4j_client() -> Neo4jClient:
     return Neo4jClient()
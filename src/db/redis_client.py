@@ -1,23 +1,240 @@
-"""Redis cache for recent user sessions and recommendations."""
-import json
+"""Redis cache for recent user sessions and recommendations.
+
+Recommendation entries are stamped with the pipeline data version. `run_pipeline` bumps the
+version on success, and entries with an older stamp read as misses, so invalidation needs no
+SCAN/DEL sweep (stale keys simply age out). Flushing a user's events deletes their entry and
+stamps a per-user version, which API workers fold into the keys of their in-process
+intermediates. Each entry carries a soft expiry; the Redis TTL is
+the hard expiry. Values use a small binary encoding instead of JSON.
+
+Vector compressors are published here too, each bound to the Milvus collection whose vectors it
+produces, so every process (API containers included) compresses for the collection it writes to.
+
+The known-users Bloom filter is a Redis bitmap, so new users can be added with SETBIT without
+rewriting it; the popular-campaigns fallback uses the recommendation entry encoding.
+"""
+import struct
+import time
+from typing import NamedTuple
+
 import redis
+from src.utils.bloom import BloomFilter, bit_positions
 from src.utils.config import settings
 
+DATA_VERSION_KEY = "meta:recommendations:data_version"
+POPULAR_CAMPAIGNS_KEY = "meta:recommendations:popular"
+KNOWN_USERS_KEY = "meta:known_users:bloom"
+KNOWN_USERS_PARAMS_KEY = "meta:known_users:params"
+KNOWN_USERS_ADDED_KEY = "meta:known_users:added"  # users added since the last rebuild
+_USER_VERSION_PREFIX = "meta:user_version:"
+COMPRESSOR_KEY_PREFIX = "meta:compressor:"
+COLLECTION_COMPRESSORS_KEY = "meta:milvus:collection_compressors"
+_REFRESH_LOCK_SECONDS = 30
 
-def get_redis_client() -> redis.Redis:
-    return redis.from_url(settings.redis_url, decode_responses=True)
+# Entry: format, data_version, soft_expires_at, item count; then per item: id length, id, score tag, score.
+_FORMAT = 1
+_HEADER = struct.Struct("!BQdI")
+_ID_LEN = struct.Struct("!H")
+_INT_SCORE = struct.Struct("!q")
+_FLOAT_SCORE = struct.Struct("!d")
 
+_clients: dict[bool, redis.Redis] = {}
 
-def cache_recommendations(user_id: str, payload: list[dict]) -> None:
-    client = get_redis_client()
-    key = f"recommendations:{user_id}"
-    client.setex(key, settings.redis_ttl_seconds, json.dumps(payload))
+
+class CachedRecommendations(NamedTuple):
+    payload: list[dict] | None  # None on miss (absent, undecodable or older data version)
+    stale: bool  # past soft expiry: serve, but refresh in the background
+    data_version: int  # current data version, to stamp a recomputed entry with
+    user_version: int = 0  # changes whenever the user's events are flushed; 0 if never
+
+
+def get_redis_client(decode_responses: bool = True) -> redis.Redis:
+    if decode_responses not in _clients:
+        _clients[decode_responses] = redis.from_url(settings.redis_url, decode_responses=decode_responses)
+    return _clients[decode_responses]
+
+
+def _key(user_id: str) -> str:
+    return f"recommendations:{user_id}"
+
+
+def _encode_entry(data_version: int, soft_expires_at: float, payload: list[dict]) -> bytes:
+    parts = [_HEADER.pack(_FORMAT, data_version, soft_expires_at, len(payload))]
+    for item in payload:
+        cid = str(item["campaign_id"]).encode()
+        score = item["engagement_score"]
+        parts.append(_ID_LEN.pack(len(cid)))
+        parts.append(cid)
+        if isinstance(score, int):
+            parts.append(b"i" + _INT_SCORE.pack(score))
+        else:
+            parts.append(b"f" + _FLOAT_SCORE.pack(float(score)))
+    return b"".join(parts)
+
+
+def _decode_entry(raw: bytes) -> tuple[int, float, list[dict]]:
+    fmt, data_version, soft_expires_at, count = _HEADER.unpack_from(raw, 0)
+    if fmt != _FORMAT:
+        raise ValueError(f"Unknown recommendation cache format {fmt}")
+    offset = _HEADER.size
+    payload = []
+    for _ in range(count):
+        (n,) = _ID_LEN.unpack_from(raw, offset)
+        offset += _ID_LEN.size
+        cid = raw[offset:offset + n].decode()
+        offset += n
+        tag = raw[offset:offset + 1]
+        offset += 1
+        score_struct = _INT_SCORE if tag == b"i" else _FLOAT_SCORE
+        (score,) = score_struct.unpack_from(raw, offset)
+        offset += score_struct.size
+        payload.append({"campaign_id": cid, "engagement_score": score})
+    return data_version, soft_expires_at, payload
+
+
+def get_data_version() -> int:
+    raw = get_redis_client().get(DATA_VERSION_KEY)
+    return int(raw) if raw else 0
+
+
+def bump_data_version() -> int:
+    """Invalidate every cached recommendation at once (called after a successful pipeline run)."""
+    return int(get_redis_client().incr(DATA_VERSION_KEY))
+
+
+def cache_recommendations(user_id: str, payload: list[dict], data_version: int | None = None) -> None:
+    """Store an entry stamped with `data_version` (the version the result was computed against)."""
+    client = get_redis_client(decode_responses=False)
+    if data_version is None:
+        data_version = get_data_version()
+    soft_expires_at = time.time() + settings.redis_soft_ttl_seconds
+    client.setex(_key(user_id), settings.redis_ttl_seconds, _encode_entry(data_version, soft_expires_at, payload))
+
+
+def get_cached_recommendations(user_id: str) -> CachedRecommendations:
+    client = get_redis_client(decode_responses=False)
+    version_raw, user_version_raw, raw = client.mget(DATA_VERSION_KEY, _USER_VERSION_PREFIX + user_id, _key(user_id))
+    data_version = int(version_raw) if version_raw else 0
+    user_version = int(user_version_raw) if user_version_raw else 0
+    if raw is None:
+        return CachedRecommendations(None, False, data_version, user_version)
+    try:
+        entry_version, soft_expires_at, payload = _decode_entry(raw)
+    except (struct.error, ValueError, UnicodeDecodeError):
+        return CachedRecommendations(None, False, data_version, user_version)
+    if entry_version != data_version:
+        return CachedRecommendations(None, False, data_version, user_version)
+    return CachedRecommendations(payload, time.time() >= soft_expires_at, data_version, user_version)
+
+
+def invalidate_recommendations(user_ids) -> None:
+    """
+    Drop specific users' entries and stamp a new user version (after their new events were
+    flushed), so every API worker stops using intermediates cached for them. The stamp is a
+    timestamp rather than a counter, so it never repeats after the key expires; the in-process
+    caches expire sooner than the key.
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    pipe = get_redis_client().pipeline(transaction=False)
+    pipe.delete(*[_key(u) for u in user_ids])
+    stamp = time.time_ns()
+    for u in user_ids:
+        pipe.set(_USER_VERSION_PREFIX + u, stamp, ex=settings.redis_ttl_seconds)
+    pipe.execute()
 
 
-def get_cached_recommendations(user_id: str) -> list[dict] | None:
+def claim_refresh(user_id: str) -> bool:
+    """True for exactly one caller per user while a background refresh is in flight."""
     client = get_redis_client()
-    key = f"recommendations:{user_id}"
-    raw = client.get(key)
+    return bool(client.set(f"refresh:recommendations:{user_id}", "1", nx=True, ex=_REFRESH_LOCK_SECONDS))
+
+
+def publish_compressor(collection: str, version: str, blob: bytes) -> None:
+    """Store a serialized compressor and bind it to `collection` (in one transaction)."""
+    pipe = get_redis_client(decode_responses=False).pipeline(transaction=True)
+    pipe.set(COMPRESSOR_KEY_PREFIX + version, blob)
+    pipe.hset(COLLECTION_COMPRESSORS_KEY, collection, version)
+    pipe.execute()
+
+
+def get_collection_compressor(collection: str) -> str | None:
+    """Version of the compressor bound to `collection`, or None if it stores raw vectors."""
+    return get_redis_client().hget(COLLECTION_COMPRESSORS_KEY, collection)
+
+
+def get_compressor_blob(version: str) -> bytes | None:
+    return get_redis_client(decode_responses=False).get(COMPRESSOR_KEY_PREFIX + version)
+
+
+def cache_popular_campaigns(payload: list[dict]) -> None:
+    """Store the cold-start list (no expiry; replaced by each pipeline run)."""
+    get_redis_client(decode_responses=False).set(POPULAR_CAMPAIGNS_KEY, _encode_entry(0, 0.0, payload))
+
+
+def get_popular_campaigns() -> list[dict]:
+    raw = get_redis_client(decode_responses=False).get(POPULAR_CAMPAIGNS_KEY)
     if raw is None:
+        return []
+    try:
+        return _decode_entry(raw)[2]
+    except (struct.error, ValueError, UnicodeDecodeError):
+        return []
+
+
+def save_known_users(bloom: BloomFilter, count: int) -> None:
+    """
+    Replace the known-users filter (bitmap and its parameters) in one transaction. Users that
+    add_known_users recorded since the last rebuild are merged in first; the transaction is
+    retried if more arrive meanwhile, so users added while `bloom` was being built are not lost.
+    """
+    def save(pipe) -> None:
+        added = [u.decode("utf-8") for u in pipe.smembers(KNOWN_USERS_ADDED_KEY)]
+        bloom.update(added)
+        pipe.multi()
+        pipe.set(KNOWN_USERS_KEY, bloom.to_bytes())
+        pipe.delete(KNOWN_USERS_PARAMS_KEY)
+        pipe.hset(
+            KNOWN_USERS_PARAMS_KEY,
+            mapping={"num_bits": bloom.num_bits, "num_hashes": bloom.num_hashes, "count": count + len(added)},
+        )
+        pipe.delete(KNOWN_USERS_ADDED_KEY)
+
+    get_redis_client(decode_responses=False).transaction(save, KNOWN_USERS_ADDED_KEY)
+
+
+def load_known_users() -> tuple[BloomFilter, int] | None:
+    """(filter, users it was built from), or None if the pipeline has not built one yet."""
+    pipe = get_redis_client(decode_responses=False).pipeline(transaction=True)
+    pipe.hgetall(KNOWN_USERS_PARAMS_KEY)
+    pipe.get(KNOWN_USERS_KEY)
+    params, bits = pipe.execute()
+    if not params:
         return None
-    return json.loads(raw)
+    bloom = BloomFilter(int(params[b"num_bits"]), int(params[b"num_hashes"]), bits)
+    return bloom, int(params.get(b"count", 0))
+
+
+def add_known_users(user_ids, new: int | None = None) -> None:
+    """
+    Set the filter bits for users (`new` of them not seen before; default all) and record them
+    for the next rebuild to merge. Runs against the parameters it read, retrying if a rebuild
+    replaces the filter in between.
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+
+    def add(pipe) -> None:
+        params = pipe.hmget(KNOWN_USERS_PARAMS_KEY, "num_bits", "num_hashes")
+        pipe.multi()
+        pipe.sadd(KNOWN_USERS_ADDED_KEY, *user_ids)
+        if all(params):
+            num_bits, num_hashes = int(params[0]), int(params[1])
+            for user_id in user_ids:
+                for pos in bit_positions(user_id, num_bits, num_hashes):
+                    pipe.setbit(KNOWN_USERS_KEY, pos, 1)
+            pipe.hincrby(KNOWN_USERS_PARAMS_KEY, "count", len(user_ids) if new is None else new)
+
+    get_redis_client().transaction(add, KNOWN_USERS_PARAMS_KEY)
@@ -49,6 +49,24 @@ def upsert_engagement(conn, user_id: str, campaign_id: str, count_delta: int = 1
     conn.commit()
 
 
+def upsert_engagement_many(conn, rows: list[tuple[str, str, int]]):
+    """Batched upsert_engagement: rows of (user_id, campaign_id, count_delta), one commit."""
+    if not rows:
+        return
+    now = datetime.utcnow().isoformat()
+    conn.executemany(
+        """
+        INSERT INTO user_engagement (user_id, campaign_id, engagement_count, last_updated)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(user_id, campaign_id) DO UPDATE SET
+            engagement_count = engagement_count + excluded.engagement_count,
+            last_updated = excluded.last_updated
+        """,
+        [(user_id, campaign_id, count_delta, now) for user_id, campaign_id, count_delta in rows],
+    )
+    conn.commit()
+
+
 def get_campaign_engagement_ranked(conn, campaign_ids: list[str]) -> list[tuple]:
     """Return (campaign_id, total_engagement) sorted by total engagement desc."""
     if not campaign_ids:
@@ -67,6 +85,38 @@ def get_campaign_engagement_ranked(conn, campaign_ids: list[str]) -> list[tuple]
     return cur.fetchall()
 
 
+def get_campaign_engagement_stats(conn, campaign_ids: list[str]) -> list[tuple]:
+    """Return (campaign_id, total_engagement, last_updated) for each campaign with engagement."""
+    if not campaign_ids:
+        return []
+    placeholders = ",".join("?" * len(campaign_ids))
+    cur = conn.execute(
+        f"""
+        SELECT campaign_id, SUM(engagement_count) AS total, MAX(last_updated)
+        FROM user_engagement
+        WHERE campaign_id IN ({placeholders})
+        GROUP BY campaign_id
+        """,
+        campaign_ids,
+    )
+    return cur.fetchall()
+
+
+def get_top_campaigns(conn, limit: int) -> list[tuple]:
+    """Return (campaign_id, total_engagement) for the most engaged campaigns overall."""
+    cur = conn.execute(
+        """
+        SELECT campaign_id, SUM(engagement_count) AS total
+        FROM user_engagement
+        GROUP BY campaign_id
+        ORDER BY total DESC
+        LIMIT ?
+        """,
+        (limit,),
+    )
+    return cur.fetchall()
+
+
 def record_pipeline_run(conn, run_id: str, stage: str, record_count: int, status: str, started_at: str, finished_at: str = None):
     conn.execute(
         "INSERT OR REPLACE INTO pipeline_runs (run_id, stage, record_count, status, started_at, finished_at) VALUES (?, ?, ?, ?, ?, ?)",
@@ -1,12 +1,15 @@
-from .dag import run_pipeline
+from .dag import run_pipeline, run_pipeline_parallel
 from .ingest import ingest_file
 from .embeddings import generate_embeddings
+from .compression import compress_records
 from .stores import store_mongodb, store_milvus, store_neo4j_and_sqlite
 
 __all__ = [
     "run_pipeline",
+    "run_pipeline_parallel",
     "ingest_file",
     "generate_embeddings",
+    "compress_records",
     "store_mongodb",
     "store_milvus",
     "store_neo4j_and_sqlite",
@@ -0,0 +1,215 @@
+"""Re-embed stored conversations from MongoDB into a new Milvus collection, then swap it in.
+
+Streams `conversations` in _id order through a projected cursor, embeds bounded chunks into a
+versioned target collection and checkpoints the last _id after every chunk, so an interrupted
+backfill resumes where it stopped. Readers keep using the active collection until the final
+pointer swap. Other processes may keep writing to the previous collection until their cached
+pointer expires, so after the swap one more catch-up pass runs before the backfill is marked
+done. ObjectIds are only ordered within one process, so that pass starts backfill_overlap_seconds
+before the checkpoint's generation time and skips messages already in the target. Run with: python -m src.pipeline.backfill [--target NAME] [--no-swap]
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+from src.db import (
+    get_conversations_collection,
+    get_backfill_checkpoints_collection,
+    create_collection_if_not_exists,
+    get_collection,
+    insert_vectors,
+    existing_message_ids,
+    get_active_collection_name,
+    set_active_collection_name,
+    bump_data_version,
+)
+from src.db.milvus_client import ACTIVE_NAME_TTL_SECONDS
+from src.pipeline.embeddings import generate_embeddings
+from src.pipeline.compression import (
+    VectorCompressor,
+    activate_compressor,
+    compress_records,
+    compression_enabled,
+    fit_compressor,
+    load_compressor,
+)
+from src.pipeline.stores import record_lineage
+from src.utils.config import settings
+from src.utils.schemas import ConversationRecord
+from src.utils.logger import log_pipeline_stage, log_anomaly, measure_latency
+
+_PROJECTION = {"message_id": 1, "user_id": 1, "message": 1, "timestamp": 1}
+
+
+def _to_records(docs: list[dict]) -> list[ConversationRecord]:
+    records = []
+    for d in docs:
+        try:
+            records.append(ConversationRecord(
+                user_id=d["user_id"], message=d["message"], timestamp=d["timestamp"], message_id=d.get("message_id")
+            ))
+        except Exception as e:
+            log_anomaly("schema_validation", str(e), message_id=d.get("message_id"))
+    return records
+
+
+def _stream_chunks(after_id, chunk_size: int):
+    """Yield lists of at most chunk_size docs with _id > after_id, re-querying until caught up."""
+    conversations = get_conversations_collection()
+    while True:
+        query = {"_id": {"$gt": after_id}} if after_id is not None else {}
+        cursor = conversations.find(query, projection=_PROJECTION).sort("_id", 1).batch_size(chunk_size)
+        chunk, seen = [], 0
+        for doc in cursor:
+            chunk.append(doc)
+            seen += 1
+            if len(chunk) >= chunk_size:
+                yield chunk
+                after_id, chunk = chunk[-1]["_id"], []
+        if chunk:
+            yield chunk
+            after_id = chunk[-1]["_id"]
+        if not seen:
+            # Nothing arrived since the previous pass (documents written during the backfill included).
+            return
+
+
+def _overlap_start(last_id):
+    """An _id settings.backfill_overlap_seconds older than last_id's generation time."""
+    if not isinstance(last_id, ObjectId):
+        return last_id
+    return ObjectId.from_datetime(last_id.generation_time - timedelta(seconds=settings.backfill_overlap_seconds))
+
+
+def _catch_up(coll, target: str, state: dict, chunk_size: int, compressor, run_id: str, skip_existing: bool = False) -> None:
+    """Embed every document after state["last_id"] into coll, checkpointing after each chunk."""
+    checkpoints = get_backfill_checkpoints_collection()
+    for docs in _stream_chunks(state["last_id"], chunk_size):
+        records = _to_records(docs)
+        if skip_existing and records:
+            existing = existing_message_ids(coll, [r.message_id for r in records])
+            records = [r for r in records if r.message_id not in existing]
+        if records:
+            enriched = generate_embeddings(records, run_id, collection=target)
+            enriched = compress_records(enriched, run_id, compressor=compressor)
+            with measure_latency("backfill_insert", run_id=run_id, count=len(enriched)):
+                insert_vectors(
+                    coll,
+                    [r.message_id for r in enriched],
+                    [r.user_id for r in enriched],
+                    [r.embedding for r in enriched],
+                    [r.timestamp for r in enriched],
+                )
+            state["processed"] += len(enriched)
+        state["last_id"] = docs[-1]["_id"]
+        checkpoints.update_one(
+            {"_id": target},
+            {"$set": {"last_id": state["last_id"], "processed": state["processed"], "updated_at": datetime.utcnow()}},
+        )
+        log_pipeline_stage("backfill_chunk", run_id=run_id, count=len(records), processed=state["processed"])
+
+
+def _embedding_dim(run_id: str) -> int:
+    """Dimension the current model produces (it changes when the backfill is for a new model)."""
+    probe = ConversationRecord(user_id="backfill", message="dimension probe")
+    return len(generate_embeddings([probe], run_id)[0].embedding)
+
+
+def _fit_target_compressor(run_id: str) -> VectorCompressor:
+    docs = list(get_conversations_collection().find({}, projection=_PROJECTION).limit(settings.vector_compression_sample_size))
+    sample = generate_embeddings(_to_records(docs), run_id)
+    with measure_latency("fit_compressor", run_id=run_id, sample_size=len(sample)):
+        return fit_compressor([r.embedding for r in sample])
+
+
+def run_backfill(
+    target: str | None = None,
+    chunk_size: int = 512,
+    swap: bool = True,
+    refit_compressor: bool = False,
+) -> dict:
+    """
+    Rebuild vectors for every stored conversation into `target` (default: a new versioned name,
+    or the unfinished backfill to resume). When `swap` is set, the target becomes the active
+    collection once every document has been embedded.
+    """
+    checkpoints = get_backfill_checkpoints_collection()
+    if target is None:
+        unfinished = checkpoints.find_one({"status": "running"}, sort=[("started_at", -1)])
+        target = unfinished["_id"] if unfinished else f"{settings.milvus_collection}_{datetime.utcnow():%Y%m%d%H%M%S}"
+    checkpoint = checkpoints.find_one({"_id": target}) or {}
+    if checkpoint.get("status") == "done":
+        raise ValueError(f"Backfill into {target} already finished")
+    # A swapped backfill still running only needs its post-swap catch-up pass.
+    resume_after_swap = bool(checkpoint.get("swapped"))
+    if target == get_active_collection_name() and not resume_after_swap:
+        raise ValueError(f"Backfill target {target} is the active collection")
+    run_id = f"backfill-{target}"
+    started = datetime.utcnow()
+    log_pipeline_stage("backfill", run_id=run_id, target=target, resume_after=str(checkpoint.get("last_id")))
+
+    compressor = None
+    if compression_enabled():
+        if checkpoint.get("compressor_version"):
+            compressor = load_compressor(checkpoint["compressor_version"])
+        else:
+            compressor = load_compressor()
+            if refit_compressor or compressor is None or compressor.input_dim != _embedding_dim(run_id):
+                compressor = _fit_target_compressor(run_id)
+    dim = compressor.output_dim if compressor else settings.embedding_dim
+    coll = create_collection_if_not_exists(dim, name=target)
+    if compressor is not None:
+        # Bound before the first insert, so every process writing here compresses the same way.
+        activate_compressor(compressor, target)
+    checkpoints.update_one(
+        {"_id": target},
+        {
+            "$set": {"status": "running", "compressor_version": compressor.version if compressor else None},
+            "$setOnInsert": {"started_at": started, "processed": 0},
+        },
+        upsert=True,
+    )
+
+    state = {"processed": checkpoint.get("processed", 0), "last_id": checkpoint.get("last_id")}
+    summary = {"target": target, "processed": 0, "swapped": resume_after_swap, "previous": checkpoint.get("previous")}
+    try:
+        if not resume_after_swap:
+            _catch_up(coll, target, state, chunk_size, compressor, run_id)
+            if swap:
+                summary["previous"] = get_active_collection_name()
+                with measure_latency("backfill_swap", run_id=run_id):
+                    coll = get_collection(name=target)  # loads the whole collection before readers switch
+                    set_active_collection_name(target)
+                    summary["data_version"] = bump_data_version()
+                checkpoints.update_one({"_id": target}, {"$set": {"swapped": True, "previous": summary["previous"]}})
+                summary["swapped"] = True
+                log_pipeline_stage("backfill_swap", run_id=run_id, active=target, previous=summary["previous"])
+        if summary["swapped"]:
+            # Documents stored after the last pass, or by processes still writing to the previous
+            # collection until their cached pointer expires, are only in MongoDB; pick them up now.
+            # Another process's _id can sort before the checkpoint even though it was stored after
+            # that chunk was read, so re-read an overlap and skip what the target already has.
+            time.sleep(ACTIVE_NAME_TTL_SECONDS + 1)
+            state["last_id"] = _overlap_start(state["last_id"])
+            _catch_up(get_collection(name=target), target, state, chunk_size, compressor, run_id, skip_existing=True)
+    except Exception as e:
+        log_anomaly("backfill_failed", str(e), run_id=run_id, processed=state["processed"])
+        record_lineage(run_id, "backfill", state["processed"], "failed", started, datetime.utcnow())
+        raise
+
+    summary["processed"] = state["processed"]
+    checkpoints.update_one({"_id": target}, {"$set": {"status": "done", "finished_at": datetime.utcnow()}})
+    record_lineage(run_id, "backfill", state["processed"], "success", started, datetime.utcnow())
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-embed MongoDB conversations into a new Milvus collection.")
+    parser.add_argument("--target", help="Target collection (default: new versioned name, or resume the unfinished one)")
+    parser.add_argument("--chunk-size", type=int, default=512)
+    parser.add_argument("--no-swap", action="store_true", help="Build the collection but keep serving the current one")
+    parser.add_argument("--refit-compressor", action="store_true", help="Fit a new compressor for the target collection")
+    args = parser.parse_args()
+    print(run_backfill(args.target, args.chunk_size, swap=not args.no_swap, refit_compressor=args.refit_compressor))
@@ -0,0 +1,288 @@
+"""Compact vector representation: dimensionality reduction + scalar quantization of embeddings.
+
+A compressor is fitted explicitly (by the backfill) on a sample of stored conversations, saved
+under settings.vector_compressor_dir with a version, and published in Redis bound to the Milvus
+collection built with it. Every writer and reader applies the compressor bound to the collection
+it is using, so vectors always match that collection's dimension; collections without one store
+raw vectors.
+"""
+import io
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from src.db import get_active_collection_name, get_collection_compressor, get_compressor_blob, publish_compressor
+from src.utils.config import settings
+from src.utils.schemas import EnrichedRecord
+from src.utils.logger import logger, log_pipeline_stage, log_anomaly, measure_latency
+
+REDUCTIONS = ("none", "pca", "random_projection")
+QUANTIZATIONS = ("none", "int8", "float16")
+
+_UNBOUND_RECHECK_SECONDS = 5.0
+_loaded: dict[str, "VectorCompressor"] = {}
+_bindings: dict[str, tuple[float, str | None]] = {}  # collection -> (checked_at, compressor version)
+
+
+class VectorCompressor:
+    """Linear projection (optional) followed by scalar quantization (optional)."""
+
+    def __init__(
+        self,
+        version: str,
+        method: str,
+        components: np.ndarray | None,
+        quantization: str,
+        scale: np.ndarray | None,
+        input_dim: int,
+    ):
+        self.version = version
+        self.method = method
+        self.components = components
+        self.quantization = quantization
+        self.scale = scale
+        self.input_dim = input_dim
+
+    @property
+    def output_dim(self) -> int:
+        return self.input_dim if self.components is None else self.components.shape[1]
+
+    @property
+    def bytes_per_vector(self) -> int:
+        itemsize = {"int8": 1, "float16": 2}.get(self.quantization, 4)
+        return self.output_dim * itemsize
+
+    def reduce(self, vectors) -> np.ndarray:
+        x = np.asarray(vectors, dtype=np.float32)
+        if x.ndim == 1:
+            x = x.reshape(1, -1)
+        return x if self.components is None else x @ self.components
+
+    def encode(self, vectors) -> np.ndarray:
+        """Compact codes (int8 / float16 / float32) for local storage."""
+        x = self.reduce(vectors)
+        if self.quantization == "int8":
+            return np.clip(np.rint(x / self.scale), -127, 127).astype(np.int8)
+        if self.quantization == "float16":
+            return x.astype(np.float16)
+        return x
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        if self.quantization == "int8":
+            return codes.astype(np.float32) * self.scale
+        return codes.astype(np.float32)
+
+    def transform(self, vectors) -> np.ndarray:
+        """float32 vectors exactly as stored/searched (quantization error included)."""
+        return self.decode(self.encode(vectors))
+
+    def to_bytes(self) -> bytes:
+        buf = io.BytesIO()
+        np.savez(
+            buf,
+            method=self.method,
+            quantization=self.quantization,
+            input_dim=self.input_dim,
+            components=self.components if self.components is not None else np.empty(0, dtype=np.float32),
+            scale=self.scale if self.scale is not None else np.empty(0, dtype=np.float32),
+        )
+        return buf.getvalue()
+
+    @classmethod
+    def from_bytes(cls, version: str, blob: bytes) -> "VectorCompressor":
+        with np.load(io.BytesIO(blob)) as data:
+            components = data["components"] if data["components"].size else None
+            scale = data["scale"] if data["scale"].size else None
+            return cls(
+                version=version,
+                method=str(data["method"]),
+                components=components,
+                quantization=str(data["quantization"]),
+                scale=scale,
+                input_dim=int(data["input_dim"]),
+            )
+
+    def save(self, directory: str | Path | None = None) -> Path:
+        directory = Path(directory or settings.vector_compressor_dir)
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f"compressor-{self.version}.npz"
+        path.write_bytes(self.to_bytes())
+        return path
+
+    @classmethod
+    def load(cls, path: str | Path) -> "VectorCompressor":
+        path = Path(path)
+        return cls.from_bytes(path.stem.removeprefix("compressor-"), path.read_bytes())
+
+
+def compression_enabled() -> bool:
+    return settings.vector_reduction != "none" or settings.vector_quantization != "none"
+
+
+def fit_compressor(
+    vectors,
+    method: str | None = None,
+    dim: int | None = None,
+    quantization: str | None = None,
+    seed: int = 0,
+) -> VectorCompressor:
+    """
+    Fit a compressor on a sample of embeddings.
+
+    PCA directions come from the uncentered sample so inner products (Milvus IP metric) are
+    preserved rather than shifted by the mean; random projection uses a scaled Gaussian matrix.
+    """
+    method = method or settings.vector_reduction
+    quantization = quantization or settings.vector_quantization
+    if method not in REDUCTIONS:
+        raise ValueError(f"Unknown vector reduction: {method}")
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unknown vector quantization: {quantization}")
+    x = np.asarray(vectors, dtype=np.float32)
+    if x.ndim != 2 or not len(x):
+        raise ValueError("fit_compressor needs a non-empty 2-D sample")
+    input_dim = x.shape[1]
+    dim = min(dim or settings.vector_reduced_dim, input_dim)
+    # A small sample would fix a low-rank projection (and the Milvus dimension) for good.
+    min_rows = max(settings.vector_compression_min_samples, dim if method != "none" else 0)
+    if len(x) < min_rows:
+        raise ValueError(f"fit_compressor needs at least {min_rows} vectors, got {len(x)}")
+    if method == "pca":
+        _, _, vt = np.linalg.svd(x, full_matrices=False)
+        components = vt[:dim].T.astype(np.float32)
+        if components.shape[1] < dim:
+            log_anomaly("pca_rank_deficient", f"sample rank {components.shape[1]} < dim {dim}")
+    elif method == "random_projection":
+        rng = np.random.default_rng(seed)
+        components = (rng.standard_normal((input_dim, dim)) / np.sqrt(dim)).astype(np.float32)
+    else:
+        components = None
+    compressor = VectorCompressor(
+        version=datetime.utcnow().strftime("%Y%m%d%H%M%S%f"),
+        method=method,
+        components=components,
+        quantization=quantization,
+        scale=None,
+        input_dim=input_dim,
+    )
+    if quantization == "int8":
+        max_abs = np.abs(compressor.reduce(x)).max(axis=0)
+        compressor.scale = np.where(max_abs == 0, 1.0, max_abs / 127.0).astype(np.float32)
+    return compressor
+
+
+def activate_compressor(compressor: VectorCompressor, collection: str, directory: str | Path | None = None) -> None:
+    """Save the compressor and publish it as the one for `collection` (before any vector is written there)."""
+    compressor.save(directory)
+    publish_compressor(collection, compressor.version, compressor.to_bytes())
+    _loaded[compressor.version] = compressor
+    _bindings[collection] = (time.monotonic(), compressor.version)
+
+
+def load_compressor(version: str | None = None, directory: str | Path | None = None) -> VectorCompressor | None:
+    """Load a compressor by version (default: the active collection's), from the local directory
+    or else from Redis; None when there is none."""
+    if version is None:
+        return compressor_for_collection(get_active_collection_name())
+    if version not in _loaded:
+        path = Path(directory or settings.vector_compressor_dir) / f"compressor-{version}.npz"
+        if path.exists():
+            _loaded[version] = VectorCompressor.load(path)
+        else:
+            blob = get_compressor_blob(version)
+            if blob is None:
+                return None
+            _loaded[version] = VectorCompressor.from_bytes(version, blob)
+    return _loaded[version]
+
+
+def compressor_for_collection(collection: str) -> VectorCompressor | None:
+    """
+    The compressor bound to `collection`, or None if it stores raw vectors. A binding is
+    published before the collection gets any vector and never changes, so it is cached for
+    good; an unbound collection is re-checked every few seconds.
+    """
+    cached = _bindings.get(collection)
+    if cached is None or (cached[1] is None and time.monotonic() - cached[0] > _UNBOUND_RECHECK_SECONDS):
+        cached = (time.monotonic(), get_collection_compressor(collection))
+        _bindings[collection] = cached
+    return load_compressor(cached[1]) if cached[1] else None
+
+
+def compress_records(
+    records: list[EnrichedRecord],
+    run_id: str,
+    compressor: VectorCompressor | None = None,
+    collection: str | None = None,
+) -> list[EnrichedRecord]:
+    """Pipeline stage between embed and store: replace each embedding with its compressed form.
+
+    Uses the compressor bound to `collection` (default: the active one) unless one is passed;
+    pass the collection the records will be stored in. Never fits one: a collection without a
+    compressor gets raw vectors (run the backfill to fit one and build a collection with it).
+    """
+    if not records:
+        return records
+    compressor = compressor or compressor_for_collection(collection or get_active_collection_name())
+    if compressor is None:
+        if compression_enabled():
+            log_anomaly("compressor_not_fitted", "compression configured but the collection has no compressor; storing raw vectors", run_id=run_id)
+        return records
+    if len(records[0].embedding) != compressor.input_dim:
+        raise ValueError(
+            f"Compressor {compressor.version} expects {compressor.input_dim}-dim input, got {len(records[0].embedding)}"
+        )
+    with measure_latency("compress_vectors", run_id=run_id, count=len(records)):
+        vectors = compressor.transform([r.embedding for r in records]).tolist()
+    log_pipeline_stage("compress", run_id=run_id, count=len(records), version=compressor.version, bytes_per_vector=compressor.bytes_per_vector)
+    return [r.model_copy(update={"embedding": v}) for r, v in zip(records, vectors)]
+
+
+def to_query_space(embedding: list[float], collection: str | None = None) -> list[float]:
+    """Apply the compressor of the searched collection (default: the active one) to a raw
+    (model-dimension) query; compressed queries pass through."""
+    compressor = compressor_for_collection(collection or get_active_collection_name())
+    if compressor is None or len(embedding) != compressor.input_dim:
+        return embedding
+    return compressor.transform(embedding)[0].tolist()
+
+
+def _top_k(queries: np.ndarray, corpus: np.ndarray, k: int, self_idx: np.ndarray) -> np.ndarray:
+    sims = queries @ corpus.T
+    sims[np.arange(len(queries)), self_idx] = -np.inf
+    return np.argpartition(-sims, k - 1, axis=1)[:, :k]
+
+
+def evaluate_compression(vectors, compressor: VectorCompressor | None = None, k: int = 10, n_queries: int = 200) -> dict:
+    """
+    Storage bytes per vector and recall@k of compressed vs uncompressed exact IP search.
+
+    Queries are drawn from `vectors` itself (each query's own row is excluded from its results).
+    """
+    x = np.asarray(vectors, dtype=np.float32)
+    compressor = compressor or load_compressor() or fit_compressor(x)
+    k = min(k, len(x) - 1)
+    if k < 1:
+        raise ValueError("Need at least 2 vectors to evaluate recall")
+    q_idx = np.arange(min(n_queries, len(x)))
+    exact = _top_k(x[q_idx], x, k, q_idx)
+    compressed = compressor.transform(x)
+    approx = _top_k(compressed[q_idx], compressed, k, q_idx)
+    recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(exact.tolist(), approx.tolist())])
+    report = {
+        "version": compressor.version,
+        "method": compressor.method,
+        "quantization": compressor.quantization,
+        "input_dim": compressor.input_dim,
+        "output_dim": compressor.output_dim,
+        "bytes_per_vector_raw": compressor.input_dim * 4,
+        "bytes_per_vector": compressor.bytes_per_vector,
+        "compression_ratio": round(compressor.input_dim * 4 / compressor.bytes_per_vector, 2),
+        "k": k,
+        "queries": len(q_idx),
+        "recall_at_k": round(float(recall), 4),
+    }
+    logger.info("vector_compression_eval", **report)
+    return report
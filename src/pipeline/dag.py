@@ -1,14 +1,58 @@
-"""Orchestrated pipeline DAG: ingest -> embed -> store (MongoDB, Milvus, Neo4j, SQLite)."""
+"""Orchestrated pipeline DAG: ingest -> embed -> compress -> store (MongoDB, Milvus, Neo4j, SQLite)."""
+import multiprocessing
+import os
 import uuid
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
-from src.pipeline.ingest import ingest_file
+from src.pipeline.ingest import ingest_file, ingest_items, read_items
 from src.pipeline.embeddings import generate_embeddings
-from src.pipeline.stores import store_mongodb, store_milvus, store_neo4j_and_sqlite, record_lineage
+from src.pipeline.compression import compress_records, load_compressor
+from src.pipeline.stores import (
+    store_mongodb,
+    store_milvus,
+    store_neo4j_and_sqlite,
+    record_lineage,
+    apply_milvus_retention,
+    rebuild_known_users,
+    refresh_popular_campaigns,
+)
+from src.db import (
+    bump_data_version,
+    get_conversations_collection,
+    ensure_indexes,
+    get_collection,
+    get_active_collection_name,
+    get_neo4j_client,
+    get_connection,
+    init_analytics_schema,
+)
+from src.utils.config import settings
+from src.utils.hashing import shard_for
 from src.utils.logger import log_pipeline_stage, log_anomaly, log_latency
 
 
+_DEFAULT_MAX_WORKERS = 4
+
+
+def _refresh_serving_state(summary: dict, run_id: str) -> None:
+    """After a run that stored data: rebuild the API's lookup structures, then bump the data version."""
+    for stage, step in (("known_users", rebuild_known_users), ("popular_campaigns", refresh_popular_campaigns)):
+        try:
+            step(run_id)
+        except Exception as e:
+            log_anomaly(f"{stage}_failed", str(e), run_id=run_id)
+    try:
+        summary["data_version"] = bump_data_version()
+    except Exception as e:
+        log_anomaly("cache_invalidation_failed", str(e), run_id=run_id)
+    try:
+        apply_milvus_retention(run_id)
+    except Exception as e:
+        log_anomaly("milvus_retention_failed", str(e), run_id=run_id)
+
+
 def run_pipeline(input_path: str | Path, run_id: str | None = None) -> dict:
     run_id = run_id or str(uuid.uuid4())
     started = datetime.utcnow()
@@ -24,7 +68,8 @@ def run_pipeline(input_path: str | Path, run_id: str | None = None) -> dict:
             log_anomaly("empty_ingest", "No valid records after ingest", run_id=run_id)
             return summary
 
-        enriched = generate_embeddings(records, run_id)
+        target = get_active_collection_name()  # embed and compress for the collection the vectors go to
+        enriched = generate_embeddings(records, run_id, collection=target)
         summary["stages"]["embed"] = len(enriched)
         if not enriched:
             log_anomaly("empty_embeddings", "No enriched records after embedding", run_id=run_id)
@@ -33,8 +78,9 @@ def run_pipeline(input_path: str | Path, run_id: str | None = None) -> dict:
             summary["error"] = "No enriched records"
             return summary
 
+        enriched = compress_records(enriched, run_id, collection=target)
         store_mongodb(enriched, run_id)
-        store_milvus(enriched, run_id)
+        store_milvus(enriched, run_id, collection=target)
         store_neo4j_and_sqlite(enriched, run_id)
 
         finished = datetime.utcnow()
@@ -42,6 +88,7 @@ def run_pipeline(input_path: str | Path, run_id: str | None = None) -> dict:
         record_lineage(run_id, "full_pipeline", len(enriched), "success", started, finished)
         summary["stages"]["store"] = len(enriched)
         summary["finished_at"] = finished.isoformat()
+        _refresh_serving_state(summary, run_id)
         log_pipeline_stage("pipeline_complete", run_id=run_id, status="success", duration_seconds=round(duration_sec, 2), **summary["stages"])
         log_latency("pipeline_run", duration_sec * 1000, run_id=run_id, record_count=len(enriched))
         return summary
@@ -54,3 +101,104 @@ def run_pipeline(input_path: str | Path, run_id: str | None = None) -> dict:
         duration_sec = (datetime.utcnow() - started).total_seconds()
         log_latency("pipeline_run", duration_sec * 1000, run_id=run_id)
         return summary
+
+
+def _init_worker(workers: int) -> None:
+    import torch
+
+    # Split the cores between workers instead of every worker's torch using all of them.
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // workers))
+
+
+def _run_shard(shard: int, items: list[dict], run_id: str) -> dict:
+    """Worker: ingest -> embed -> compress -> store for one shard. Lineage is recorded by the parent."""
+    result = {"shard": shard, "ingest": 0, "embed": 0, "store": 0, "error": None}
+    try:
+        records = ingest_items(items, run_id)
+        result["ingest"] = len(records)
+        if not records:
+            return result
+        target = get_active_collection_name()  # embed and compress for the collection the vectors go to
+        enriched = generate_embeddings(records, run_id, collection=target)
+        result["embed"] = len(enriched)
+        if not enriched:
+            return result
+        enriched = compress_records(enriched, run_id, collection=target)
+        store_mongodb(enriched, run_id)
+        store_milvus(enriched, run_id, collection=target)
+        store_neo4j_and_sqlite(enriched, run_id)
+        result["store"] = len(enriched)
+        log_pipeline_stage("shard_complete", run_id=run_id, shard=shard, count=len(enriched))
+    except Exception as e:
+        log_anomaly("shard_failed", str(e), run_id=run_id, shard=shard)
+        result["error"] = str(e)
+    return result
+
+
+def _prepare_shared_state() -> None:
+    """One-time setup that workers would otherwise race on: indexes, collection, constraints."""
+    compressor = load_compressor()
+    ensure_indexes(get_conversations_collection())
+    get_collection(dim=compressor.output_dim if compressor else settings.embedding_dim)
+    neo4j = get_neo4j_client()
+    neo4j.ensure_constraints()
+    neo4j.close()
+    init_analytics_schema(get_connection())
+
+
+def run_pipeline_parallel(input_path: str | Path, workers: int | None = None, run_id: str | None = None) -> dict:
+    """
+    run_pipeline across a process pool. Input is partitioned by a stable hash of user_id, so
+    every write for a given user (graph, analytics) happens on one worker, on every run.
+    """
+    run_id = run_id or str(uuid.uuid4())
+    # Every worker loads its own embedding model (~1.4 GB for the default), so stay conservative.
+    workers = workers or settings.pipeline_workers or min(_DEFAULT_MAX_WORKERS, os.cpu_count() or 1)
+    started = datetime.utcnow()
+    summary = {"run_id": run_id, "stages": {}, "status": "success", "error": None, "workers": workers}
+
+    try:
+        log_pipeline_stage("ingest", run_id=run_id, source=str(input_path), workers=workers)
+        items = read_items(input_path)
+        shards: list[list[dict]] = [[] for _ in range(workers)]
+        for item in items:
+            shards[shard_for(str(item.get("user_id", "")), workers)].append(item)
+        _prepare_shared_state()
+
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(workers,),
+        ) as pool:
+            futures = [pool.submit(_run_shard, i, shard, run_id) for i, shard in enumerate(shards) if shard]
+            results = [f.result() for f in futures]
+
+        for stage in ("ingest", "embed", "store"):
+            summary["stages"][stage] = sum(r[stage] for r in results)
+        summary["shards"] = results
+        finished = datetime.utcnow()
+        duration_sec = (finished - started).total_seconds()
+        if errors := [f"shard {r['shard']}: {r['error']}" for r in results if r["error"]]:
+            summary["status"] = "failed"
+            summary["error"] = "; ".join(errors)
+        elif not summary["stages"]["store"]:
+            summary["status"] = "failed"
+            summary["error"] = "No records stored"
+            log_anomaly("empty_ingest", "No valid records after ingest", run_id=run_id)
+        record_lineage(run_id, "full_pipeline", summary["stages"]["store"], summary["status"], started, finished)
+        summary["finished_at"] = finished.isoformat()
+        if summary["stages"]["store"]:
+            _refresh_serving_state(summary, run_id)
+        log_pipeline_stage("pipeline_complete", run_id=run_id, status=summary["status"], duration_seconds=round(duration_sec, 2), workers=workers, **summary["stages"])
+        log_latency("pipeline_run", duration_sec * 1000, run_id=run_id, record_count=summary["stages"]["store"])
+        return summary
+
+    except Exception as e:
+        log_anomaly("pipeline_failed", str(e), run_id=run_id)
+        record_lineage(run_id, "pipeline", 0, "failed", started, datetime.utcnow())
+        summary["status"] = "failed"
+        summary["error"] = str(e)
+        duration_sec = (datetime.utcnow() - started).total_seconds()
+        log_latency("pipeline_run", duration_sec * 1000, run_id=run_id)
+        return summary
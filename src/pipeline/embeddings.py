@@ -1,20 +1,68 @@
-"""Generate 1024-dim embeddings with Sentence Transformers (uses torch backend)."""
+"""Generate 1024-dim embeddings with Sentence Transformers (uses torch backend).
+
+CPU inference modes (settings.embedding_inference_mode):
+- fp32: full-precision model (default).
+- int8: dynamic int8 quantization of the linear layers, applied at load time.
+- bf16: linear layers run under CPU bfloat16 autocast.
+"""
+import time
+
+import numpy as np
+import torch
 from sentence_transformers import SentenceTransformer
 
+from src.db import get_active_collection_name
+from src.pipeline.compression import compressor_for_collection
 from src.utils.config import settings
 from src.utils.schemas import ConversationRecord, EnrichedRecord
-from src.utils.logger import log_pipeline_stage, log_anomaly, measure_latency
+from src.utils.logger import logger, log_pipeline_stage, log_anomaly, measure_latency
+
+INFERENCE_MODES = ("fp32", "int8", "bf16")
 
 _model: SentenceTransformer | None = None
 
 
+def _load_quantized_model(model_name: str) -> SentenceTransformer:
+    """fp32 model with its linear layers dynamically quantized to int8 (deterministic, so not cached)."""
+    model = SentenceTransformer(model_name, device="cpu")
+    with measure_latency("quantize_model", model=model_name):
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def load_embedding_model(mode: str | None = None, device: str | None = None) -> SentenceTransformer:
+    """Load settings.embedding_model in the given inference mode (defaults to the configured one)."""
+    mode = mode or settings.embedding_inference_mode
+    if mode not in INFERENCE_MODES:
+        raise ValueError(f"Unknown embedding inference mode: {mode}")
+    if mode == "int8":
+        model = _load_quantized_model(settings.embedding_model)
+    elif mode == "bf16":
+        model = SentenceTransformer(settings.embedding_model, device="cpu")
+    else:
+        model = SentenceTransformer(settings.embedding_model, device=device)
+    if settings.embedding_max_seq_length > 0:
+        model.max_seq_length = min(model.max_seq_length or settings.embedding_max_seq_length, settings.embedding_max_seq_length)
+    model.eval()
+    return model
+
+
 def get_embedding_model() -> SentenceTransformer:
     global _model
     if _model is None:
-        _model = SentenceTransformer("sentence-transformers/all-roberta-large-v1")
+        _model = load_embedding_model()
     return _model
 
 
+def encode_texts(model: SentenceTransformer, texts: list[str], mode: str | None = None) -> np.ndarray:
+    """Encode texts, running the linear layers in bf16 when the mode asks for it."""
+    mode = mode or settings.embedding_inference_mode
+    with torch.inference_mode():
+        if mode == "bf16":
+            with torch.autocast("cpu", dtype=torch.bfloat16):
+                return model.encode(texts, show_progress_bar=False)
+        return model.encode(texts, show_progress_bar=False)
+
+
 def _ensure_dim(embedding: list[float], target_dim: int) -> list[float]:
     """Pad or truncate to target_dim (e.g. 1024). For demo we pad with zeros if needed."""
     n = len(embedding)
@@ -27,15 +75,21 @@ def generate_embeddings(
     records: list[ConversationRecord],
     run_id: str,
     source_file: str | None = None,
+    collection: str | None = None,
 ) -> list[EnrichedRecord]:
+    """Embed records for `collection` (default: the active one). Vectors are padded or truncated
+    to EMBEDDING_DIM unless that collection's compressor takes the model's own dimension."""
     log_pipeline_stage("embed", run_id=run_id, count=len(records))
     model = get_embedding_model()
     texts = [r.message for r in records]
     with measure_latency("embed_batch", run_id=run_id, batch_size=len(texts)):
-        embeds = model.encode(texts, show_progress_bar=False).tolist()
+        embeds = encode_texts(model, texts).tolist()
     dim = getattr(settings, "embedding_dim", 1024)
-    if dim != len(embeds[0]) if embeds else 0:
-        embeds = [_ensure_dim(e, dim) for e in embeds]
+    if embeds and dim != len(embeds[0]):
+        compressor = compressor_for_collection(collection or get_active_collection_name())
+        # A compressor fitted on raw vectors projects them itself; padding would break its input.
+        if compressor is None or compressor.input_dim != len(embeds[0]):
+            embeds = [_ensure_dim(e, dim) for e in embeds]
     enriched = []
     for r, emb in zip(records, embeds):
         if not emb:
@@ -54,3 +108,58 @@ def generate_embeddings(
             )
         )
     return enriched
+
+
+def _timed_encode(model: SentenceTransformer, texts: list[str], mode: str, repeats: int) -> tuple[np.ndarray, float]:
+    """Best-of-`repeats` wall time after one warm-up batch."""
+    encode_texts(model, texts[:8], mode)
+    best, embeds = float("inf"), None
+    for _ in range(max(1, repeats)):
+        start = time.perf_counter()
+        embeds = encode_texts(model, texts, mode)
+        best = min(best, time.perf_counter() - start)
+    return np.asarray(embeds, dtype=np.float32), best
+
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    return x / np.where(norms == 0, 1.0, norms)
+
+
+def _top_k_neighbours(x: np.ndarray, k: int) -> np.ndarray:
+    sims = x @ x.T
+    np.fill_diagonal(sims, -np.inf)
+    return np.argpartition(-sims, k - 1, axis=1)[:, :k]
+
+
+def evaluate_inference_mode(texts: list[str], mode: str = "int8", top_k: int = 10, repeats: int = 3) -> dict:
+    """
+    Compare a CPU inference mode against fp32 on the same texts.
+
+    Reports encode speedup, cosine similarity between each text's fp32 and `mode` embedding
+    (drift = 1 - cosine), and mean overlap of each text's top-k neighbours within the sample.
+    """
+    if len(texts) < 2:
+        raise ValueError("Need at least 2 texts to evaluate neighbour overlap")
+    baseline, base_sec = _timed_encode(load_embedding_model("fp32", device="cpu"), texts, "fp32", repeats)
+    candidate, cand_sec = _timed_encode(load_embedding_model(mode), texts, mode, repeats)
+    base_n, cand_n = _normalize(baseline), _normalize(candidate)
+    cosine = (base_n * cand_n).sum(axis=1)
+    k = min(top_k, len(texts) - 1)
+    base_nn, cand_nn = _top_k_neighbours(base_n, k), _top_k_neighbours(cand_n, k)
+    overlap = [len(set(a) & set(b)) / k for a, b in zip(base_nn.tolist(), cand_nn.tolist())]
+    report = {
+        "mode": mode,
+        "texts": len(texts),
+        "max_seq_length": settings.embedding_max_seq_length,
+        "fp32_seconds": round(base_sec, 4),
+        "mode_seconds": round(cand_sec, 4),
+        "speedup": round(base_sec / cand_sec, 2) if cand_sec else None,
+        "cosine_mean": round(float(cosine.mean()), 5),
+        "cosine_min": round(float(cosine.min()), 5),
+        "drift_p95": round(float(np.percentile(1 - cosine, 95)), 5),
+        "top_k": k,
+        "neighbour_overlap_mean": round(float(np.mean(overlap)), 4),
+    }
+    logger.info("embedding_mode_eval", **report)
+    return report
@@ -19,15 +19,29 @@ def _parse_timestamp(ts) -> datetime:
     return datetime.utcnow()
 
 
-def ingest_file(path: str | Path, run_id: str) -> list[ConversationRecord]:
+def read_items(path: str | Path) -> list[dict]:
+    """Raw conversation objects from a JSON file (a list, or {"conversations": [...]})."""
     path = Path(path)
     if path.suffix.lower() != ".json":
         raise ValueError("Only JSON input is supported")
-    log_pipeline_stage("ingest", run_id=run_id, source=str(path))
-    records = []
     with open(path) as f:
         data = json.load(f)
-    items = data if isinstance(data, list) else data.get("conversations", [data])
+    return data if isinstance(data, list) else data.get("conversations", [data])
+
+
+def ingest_file(path: str | Path, run_id: str) -> list[ConversationRecord]:
+    path = Path(path)
+    log_pipeline_stage("ingest", run_id=run_id, source=str(path))
+    items = read_items(path)
+    records = ingest_items(items, run_id)
+    if not records:
+        log_anomaly("empty_ingest", f"No valid records from {path}", run_id=run_id)
+    return records
+
+
+def ingest_items(items: list[dict], run_id: str) -> list[ConversationRecord]:
+    """Validate raw items into records; invalid items are logged and skipped."""
+    records = []
     for item in items:
         try:
             item["timestamp"] = _parse_timestamp(item.get("timestamp", datetime.utcnow()))
@@ -35,6 +49,4 @@ def ingest_file(path: str | Path, run_id: str) -> list[ConversationRecord]:
             records.append(ConversationRecord(**item))
         except Exception as e:
             log_anomaly("schema_validation", str(e), raw=item)
-    if not records:
-        log_anomaly("empty_ingest", f"No valid records from {path}", run_id=run_id)
     return records
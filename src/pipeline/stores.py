@@ -1,4 +1,5 @@
 """Write enriched data to MongoDB, Milvus, Neo4j, SQLite."""
+from collections import Counter
 from datetime import datetime
 
 from src.db import (
@@ -6,12 +7,20 @@ from src.db import (
     ensure_indexes,
     get_collection,
     insert_vectors,
+    existing_message_ids,
+    apply_partition_retention,
     get_neo4j_client,
     get_connection,
     init_analytics_schema,
-    upsert_engagement,
+    upsert_engagement_many,
     record_pipeline_run,
+    get_top_campaigns,
+    cache_popular_campaigns,
+    save_known_users,
 )
+from src.utils.bloom import BloomFilter
+from src.utils.config import settings
+from src.utils.hashing import stable_hash
 from src.utils.schemas import EnrichedRecord
 from src.utils.logger import log_pipeline_stage, log_anomaly, measure_latency
 
@@ -36,35 +45,92 @@ def store_mongodb(records: list[EnrichedRecord], run_id: str) -> None:
     log_pipeline_stage("store_mongodb", run_id=run_id, count=len(docs))
 
 
-def store_milvus(records: list[EnrichedRecord], run_id: str) -> None:
+def store_milvus(
+    records: list[EnrichedRecord], run_id: str, skip_existing: bool = False, collection: str | None = None
+) -> None:
+    """Insert record vectors into `collection` (default: the active one); with skip_existing,
+    records whose message_id is already stored are skipped (a retry after a partly committed insert)."""
     if not records:
         log_anomaly("empty_milvus", "No records to insert", run_id=run_id)
         return
-    coll = get_collection()
+    coll = get_collection(dim=len(records[0].embedding), name=collection)
+    if skip_existing:
+        existing = existing_message_ids(coll, [r.message_id for r in records])
+        records = [r for r in records if r.message_id not in existing]
+        if not records:
+            return
     message_ids = [r.message_id for r in records]
     user_ids = [r.user_id for r in records]
     embeddings = [r.embedding for r in records]
+    timestamps = [r.timestamp for r in records]
     with measure_latency("store_milvus", run_id=run_id, count=len(embeddings)):
-        insert_vectors(coll, message_ids, user_ids, embeddings)
+        insert_vectors(coll, message_ids, user_ids, embeddings, timestamps)
     log_pipeline_stage("store_milvus", run_id=run_id, count=len(embeddings))
 
 
+def derive_campaign_and_intent(record: EnrichedRecord) -> tuple[str, str]:
+    """Prototype derivation: campaign from a stable user hash, intent from the message's first token."""
+    campaign_id = f"campaign_{stable_hash(record.user_id) % 5}"
+    intent = (record.message.split() or ["general"])[0].lower()[:50]
+    return campaign_id, intent
+
+
 def store_neo4j_and_sqlite(records: list[EnrichedRecord], run_id: str) -> None:
     """Derive user–campaign–intent from records and write to Neo4j + SQLite."""
     neo4j = get_neo4j_client()
     neo4j.ensure_constraints()
     conn = get_connection()
     init_analytics_schema(conn)
+    engagement = Counter()
+    intents = Counter()
     with measure_latency("store_neo4j_sqlite", run_id=run_id):
         for r in records:
-            campaign_id = f"campaign_{hash(r.user_id) % 5}"
-            intent = (r.message.split() or ["general"])[0].lower()[:50]
-            neo4j.upsert_user_campaign_intent(r.user_id, campaign_id, intent, engagement_count=1)
-            upsert_engagement(conn, r.user_id, campaign_id, 1)
+            campaign_id, intent = derive_campaign_and_intent(r)
+            intents[(r.user_id, campaign_id, intent)] += 1
+            engagement[(r.user_id, campaign_id)] += 1
+        # Batched, retried transactions: parallel workers share Campaign/Intent nodes and can deadlock.
+        neo4j.upsert_user_campaign_intents([
+            {"user_id": user_id, "campaign_id": campaign_id, "intent": intent, "count": n}
+            for (user_id, campaign_id, intent), n in intents.items()
+        ])
+        # One transaction instead of a commit per record (parallel workers share the SQLite file).
+        upsert_engagement_many(conn, [(user_id, campaign_id, n) for (user_id, campaign_id), n in engagement.items()])
     log_pipeline_stage("store_neo4j_sqlite", run_id=run_id, count=len(records))
     neo4j.close()
 
 
+def apply_milvus_retention(run_id: str) -> None:
+    """Drop time-bucket partitions past the retention period."""
+    with measure_latency("milvus_retention", run_id=run_id):
+        result = apply_partition_retention(get_collection())
+    if result["dropped"]:
+        log_pipeline_stage("milvus_retention", run_id=run_id, **result)
+
+
+def rebuild_known_users(run_id: str) -> int:
+    """Rebuild the known-users Bloom filter from every user_id stored in MongoDB."""
+    with measure_latency("rebuild_known_users", run_id=run_id):
+        cursor = get_conversations_collection().aggregate([{"$group": {"_id": "$user_id"}}], allowDiskUse=True)
+        user_ids = [doc["_id"] for doc in cursor if doc["_id"]]
+        # Headroom for users the events flusher adds before the next rebuild.
+        bloom = BloomFilter.for_capacity(int(len(user_ids) * settings.known_users_headroom), settings.known_users_error_rate)
+        bloom.update(user_ids)
+        save_known_users(bloom, len(user_ids))
+    log_pipeline_stage("known_users", run_id=run_id, users=len(user_ids), bits=bloom.num_bits, hashes=bloom.num_hashes)
+    return len(user_ids)
+
+
+def refresh_popular_campaigns(run_id: str) -> int:
+    """Precompute the cold-start list (most engaged campaigns overall) from the analytics DB."""
+    conn = get_connection()
+    init_analytics_schema(conn)
+    top = get_top_campaigns(conn, settings.cold_start_campaigns)
+    peak = top[0][1] if top and top[0][1] else 1
+    cache_popular_campaigns([{"campaign_id": cid, "engagement_score": round(total / peak, 6)} for cid, total in top])
+    log_pipeline_stage("popular_campaigns", run_id=run_id, count=len(top))
+    return len(top)
+
+
 def record_lineage(run_id: str, stage: str, record_count: int, status: str, started_at: datetime, finished_at: datetime | None = None) -> None:
     """Basic data lineage: persist run_id, stage, record_count, status, timestamps to pipeline_runs."""
     conn = get_connection()
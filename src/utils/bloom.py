@@ -0,0 +1,54 @@
+"""Bloom filter whose bit layout matches a Redis bitmap (SETBIT/GETBIT offsets, MSB first)."""
+import hashlib
+import math
+
+
+def bit_positions(item: str, num_bits: int, num_hashes: int) -> list[int]:
+    """Bit offsets for item (double hashing over one 128-bit blake2b digest)."""
+    digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], "big")
+    h2 = int.from_bytes(digest[8:], "big") | 1
+    return [(h1 + i * h2) % num_bits for i in range(num_hashes)]
+
+
+class BloomFilter:
+    """Set membership with no false negatives and a tunable false-positive rate."""
+
+    def __init__(self, num_bits: int, num_hashes: int, bits: bytes | bytearray | None = None):
+        if num_bits <= 0 or num_hashes <= 0:
+            raise ValueError("BloomFilter needs num_bits > 0 and num_hashes > 0")
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        size = (num_bits + 7) // 8
+        self.bits = bytearray(size)
+        if bits:
+            # Redis returns the bitmap trimmed to its last set byte.
+            self.bits[: min(len(bits), size)] = bits[:size]
+
+    @classmethod
+    def for_capacity(cls, capacity: int, error_rate: float = 0.01) -> "BloomFilter":
+        """Optimal size for `capacity` items at `error_rate` false positives."""
+        capacity = max(capacity, 1)
+        num_bits = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        num_hashes = max(1, round(num_bits / capacity * math.log(2)))
+        return cls(num_bits, num_hashes)
+
+    def positions(self, item: str) -> list[int]:
+        return bit_positions(item, self.num_bits, self.num_hashes)
+
+    def add(self, item: str) -> None:
+        for pos in self.positions(item):
+            self.bits[pos >> 3] |= 0x80 >> (pos & 7)
+
+    def update(self, items) -> None:
+        for item in items:
+            self.add(item)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[pos >> 3] & (0x80 >> (pos & 7)) for pos in self.positions(item))
+
+    def fill_ratio(self) -> float:
+        return int.from_bytes(self.bits, "big").bit_count() / self.num_bits
+
+    def to_bytes(self) -> bytes:
+        return bytes(self.bits)
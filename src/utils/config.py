@@ -15,6 +15,22 @@ class Settings(BaseSettings):
     milvus_port: int = Field(default=19530, env="MILVUS_PORT")
     milvus_collection: str = Field(default="conversation_embeddings", env="MILVUS_COLLECTION")
     embedding_dim: int = Field(default=1024, env="EMBEDDING_DIM")
+    milvus_partition_days: int = Field(default=7, env="MILVUS_PARTITION_DAYS")  # width of a time bucket
+    milvus_search_window_days: int = Field(default=0, env="MILVUS_SEARCH_WINDOW_DAYS")  # neighbour search window; 0 = all
+    milvus_retention_days: int = Field(default=0, env="MILVUS_RETENTION_DAYS")  # drop older buckets; 0 = keep
+
+    # Embedding model
+    embedding_model: str = Field(default="sentence-transformers/all-roberta-large-v1", env="EMBEDDING_MODEL")
+    embedding_inference_mode: str = Field(default="fp32", env="EMBEDDING_INFERENCE_MODE")  # fp32 | int8 | bf16
+    embedding_max_seq_length: int = Field(default=128, env="EMBEDDING_MAX_SEQ_LENGTH")
+
+    # Vector compression (between embedding and Milvus)
+    vector_reduction: str = Field(default="none", env="VECTOR_REDUCTION")  # none | pca | random_projection
+    vector_reduced_dim: int = Field(default=256, env="VECTOR_REDUCED_DIM")
+    vector_quantization: str = Field(default="none", env="VECTOR_QUANTIZATION")  # none | int8 | float16
+    vector_compression_sample_size: int = Field(default=10000, env="VECTOR_COMPRESSION_SAMPLE_SIZE")
+    vector_compression_min_samples: int = Field(default=1000, env="VECTOR_COMPRESSION_MIN_SAMPLES")
+    vector_compressor_dir: str = Field(default="data/compressors", env="VECTOR_COMPRESSOR_DIR")
 
     # Neo4j
     neo4j_uri: str = Field(default="bolt://localhost:7687", env="NEO4J_URI")
@@ -26,12 +42,65 @@ class Settings(BaseSettings):
 
     # Redis
     redis_url: str = Field(default="redis://localhost:6379/0", env="REDIS_URL")
-    redis_ttl_seconds: int = Field(default=3600, env="REDIS_TTL_SECONDS")
+    redis_ttl_seconds: int = Field(default=3600, env="REDIS_TTL_SECONDS")  # hard expiry
+    redis_soft_ttl_seconds: int = Field(default=300, env="REDIS_SOFT_TTL_SECONDS")  # serve stale + refresh after this
+
+    # Pipeline
+    pipeline_workers: int = Field(default=0, env="PIPELINE_WORKERS")  # run_pipeline_parallel; 0 = min(4, CPU count)
+    # Post-swap backfill pass re-reads this far before the checkpoint (ObjectIds from other hosts are not ordered)
+    backfill_overlap_seconds: float = Field(default=300.0, env="BACKFILL_OVERLAP_SECONDS")
 
     # API
     api_host: str = Field(default="0.0.0.0", env="API_HOST")
     api_port: int = Field(default=8000, env="API_PORT")
 
+    # Recommendation ranking
+    ranking_similar_users: int = Field(default=5, env="RANKING_SIMILAR_USERS")
+    ranking_max_candidates: int = Field(default=10000, env="RANKING_MAX_CANDIDATES")  # neighbour-campaign pairs
+    ranking_similarity_weight: float = Field(default=1.0, env="RANKING_SIMILARITY_WEIGHT")
+    ranking_engagement_weight: float = Field(default=0.5, env="RANKING_ENGAGEMENT_WEIGHT")
+    ranking_recency_half_life_hours: float = Field(default=0.0, env="RANKING_RECENCY_HALF_LIFE_HOURS")  # 0 = off
+
+    # In-process caches of retrieval intermediates (per API worker; 0 entries or TTL = disabled).
+    # The campaigns TTL is capped at REDIS_SOFT_TTL_SECONDS. The similar-users TTL is not: it bounds how
+    # long other users' new events can go unseen in a user's neighbours, and may outlive the soft TTL.
+    local_cache_embedding_max_entries: int = Field(default=4096, env="LOCAL_CACHE_EMBEDDING_MAX_ENTRIES")
+    local_cache_embedding_ttl_seconds: float = Field(default=3600.0, env="LOCAL_CACHE_EMBEDDING_TTL_SECONDS")
+    local_cache_similar_users_max_entries: int = Field(default=20000, env="LOCAL_CACHE_SIMILAR_USERS_MAX_ENTRIES")
+    local_cache_similar_users_ttl_seconds: float = Field(default=1800.0, env="LOCAL_CACHE_SIMILAR_USERS_TTL_SECONDS")
+    local_cache_campaigns_max_entries: int = Field(default=5000, env="LOCAL_CACHE_CAMPAIGNS_MAX_ENTRIES")
+    local_cache_campaigns_ttl_seconds: float = Field(default=120.0, env="LOCAL_CACHE_CAMPAIGNS_TTL_SECONDS")
+
+    # Known-user filter and cold-start fallback
+    known_users_error_rate: float = Field(default=0.01, env="KNOWN_USERS_ERROR_RATE")  # Bloom false-positive rate
+    known_users_headroom: float = Field(default=1.5, env="KNOWN_USERS_HEADROOM")  # capacity / users at rebuild
+    known_users_refresh_seconds: float = Field(default=60.0, env="KNOWN_USERS_REFRESH_SECONDS")
+    cold_start_campaigns: int = Field(default=20, env="COLD_START_CAMPAIGNS")
+
+    # Admission control (GET /recommendations): request gate per API worker
+    admission_max_inflight: int = Field(default=32, env="ADMISSION_MAX_INFLIGHT")  # keep below the threadpool size (40)
+    admission_max_waiting: int = Field(default=64, env="ADMISSION_MAX_WAITING")
+    admission_max_queue_delay_ms: float = Field(default=100.0, env="ADMISSION_MAX_QUEUE_DELAY_MS")
+    # Per-datastore concurrency limits (0 = unlimited) and circuit breakers
+    backend_milvus_max_concurrency: int = Field(default=8, env="BACKEND_MILVUS_MAX_CONCURRENCY")
+    backend_neo4j_max_concurrency: int = Field(default=8, env="BACKEND_NEO4J_MAX_CONCURRENCY")
+    backend_max_waiting: int = Field(default=16, env="BACKEND_MAX_WAITING")
+    backend_max_queue_delay_ms: float = Field(default=50.0, env="BACKEND_MAX_QUEUE_DELAY_MS")
+    breaker_window: int = Field(default=50, env="BREAKER_WINDOW")  # recent calls considered
+    breaker_min_calls: int = Field(default=20, env="BREAKER_MIN_CALLS")
+    breaker_error_rate: float = Field(default=0.5, env="BREAKER_ERROR_RATE")
+    breaker_slow_call_ms: float = Field(default=1000.0, env="BREAKER_SLOW_CALL_MS")
+    breaker_slow_call_rate: float = Field(default=0.8, env="BREAKER_SLOW_CALL_RATE")
+    breaker_open_seconds: float = Field(default=5.0, env="BREAKER_OPEN_SECONDS")
+
+    # Real-time event ingestion (POST /events)
+    events_queue_size: int = Field(default=100000, env="EVENTS_QUEUE_SIZE")
+    events_embed_batch_size: int = Field(default=64, env="EVENTS_EMBED_BATCH_SIZE")
+    events_embed_max_wait_ms: int = Field(default=50, env="EVENTS_EMBED_MAX_WAIT_MS")
+    events_flush_interval_seconds: float = Field(default=5.0, env="EVENTS_FLUSH_INTERVAL_SECONDS")
+    events_flush_max_records: int = Field(default=5000, env="EVENTS_FLUSH_MAX_RECORDS")
+    events_flush_max_retries: int = Field(default=5, env="EVENTS_FLUSH_MAX_RETRIES")  # then a store's pending writes are dropped
+
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
@@ -0,0 +1,15 @@
+"""Process-independent hashing for shard and campaign assignment.
+
+Python's built-in hash() of a str is salted per process (PYTHONHASHSEED), so it must not
+decide anything that has to agree across workers or restarts.
+"""
+import hashlib
+
+
+def stable_hash(value: str) -> int:
+    """64-bit hash of value, identical in every process and on every run."""
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def shard_for(user_id: str, num_shards: int) -> int:
+    return stable_hash(user_id) % num_shards